@@ -0,0 +1,172 @@
+import argparse
+import json
+import logging
+import platform
+import time
+import tracemalloc
+from importlib import metadata
+import numpy as np
+from bspy import Solid, Hyperplane
+from modeler import Modeler
+import utils
+import planar
+import parts
+import broadphase
+import intersections
+import instrument
+import assembly_line
+import robots
+
+# Headless benchmark suite for the modeling pipeline. Each case is timed untraced (best of repeat runs) and then
+# run once more under tracemalloc for peak memory. Results go to a JSON file that can be compared to a baseline.
+#
+# python benchmark.py --sweep quick --output results.json
+# python benchmark.py --sweep quick --baseline baseline.json
+
+sweeps = {
+    "quick" : {"frames" : (11,), "parts" : (1, 4, 16), "vertices" : (8, 64), "samples" : (2, 4), "intersectionSamples" : {"assembly_line" : (2,), "robots" : ()}},
+    "full" : {"frames" : (11, 101), "parts" : (1, 4, 16, 64), "vertices" : (8, 64, 512), "samples" : (2, 4, 8, 16), "intersectionSamples" : {"assembly_line" : (2, 3, 4), "robots" : (2,)}},
+}
+
+scenarios = {
+    "assembly_line" : {"movers" : (assembly_line.robot, assembly_line.router), "start" : 0.0},
+    "robots" : {"movers" : (robots.robot1, robots.robot2), "start" : 0.6},
+}
+
+def count_boundaries(result):
+    if isinstance(result, Solid):
+        return len(result.boundaries)
+    elif isinstance(result, (list, tuple)):
+        return sum(count_boundaries(item) for item in result)
+    return 0
+
+def clear_caches():
+    # Every cache a case could warm up, so each run starts cold.
+    parts.cache_clear()
+    utils.domain_cache_clear()
+    planar.domain_cache_clear()
+    robots.robot_graph.cache_clear()
+    assembly_line.robot_graph.cache_clear()
+    assembly_line.router_graph.cache_clear()
+    intersections.shared.clear()
+
+def measure(name, parameters, function, repeat=1):
+    wallTime = np.inf
+    for i in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        result = function()
+        wallTime = min(wallTime, time.perf_counter() - start)
+    clear_caches()
+    tracemalloc.start()
+    result = function()
+    peakMemory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    record = {"name" : name, "parameters" : parameters, "wallTime" : wallTime, "peakMemory" : peakMemory, "boundaries" : count_boundaries(result)}
+    logging.info(f"{name} {parameters}: {wallTime:.4f} s, {peakMemory / 1e6:.2f} MB, {record['boundaries']} boundaries")
+    return record
+
+def polygon(vertexCount):
+    angles = np.linspace(0.0, 2.0 * np.pi, vertexCount, endpoint=False)
+    return [(np.cos(angle), np.sin(angle)) for angle in angles]
+
+def run(sweep, repeat=3):
+    settings = sweeps[sweep]
+    results = []
+
+    for frames in settings["frames"]:
+        tValues = np.linspace(0.0, 1.0, frames)
+        results.append(measure("create_robot", {"scenario" : "assembly_line", "frames" : frames}, lambda: [assembly_line.robot(t) for t in tValues], repeat))
+        results.append(measure("create_router", {"scenario" : "assembly_line", "frames" : frames}, lambda: [assembly_line.router(t) for t in tValues], repeat))
+        results.append(measure("create_robot", {"scenario" : "robots", "frames" : frames}, lambda: [robots.robot1(t) for t in tValues], repeat))
+
+    for partCount in settings["parts"]:
+        cube = Hyperplane.create_hypercube(((-1.0, 1.0),) * 3)
+        modeler = Modeler()
+        modeler.rotate(0, 0.3, 0.1)
+        modeler.translate((1.0, 2.0, 3.0), (0.5, 0.0, 0.0))
+        results.append(measure("Modeler.transform", {"parts" : partCount}, lambda: [modeler.transform(cube) for i in range(partCount)], repeat))
+        def compose():
+            # Each robot at its own time, so no part transforms are reused between them.
+            robot = Solid(3, False)
+            for t in np.linspace(0.6, 1.0, partCount):
+                robots.create_robot(robots.robot1_parameters, t, robot)
+            return robot
+        results.append(measure("create_robot", {"scenario" : "robots", "parts" : partCount}, compose, repeat))
+
+    for vertices in settings["vertices"]:
+        points = polygon(vertices)
+        results.append(measure("extrude_path", {"vertices" : vertices},
+            lambda: utils.extrude_path(utils.create_faceted_solid_from_points(points), ((0.0, 0.0, 0.0), (0.0, 0.0, 1.0))), repeat))
+
+    for scenario, description in scenarios.items():
+        for samples in settings["samples"]:
+            tValues = np.linspace(description["start"], 1.0, samples)
+            for mover in description["movers"]:
+                results.append(measure("extrude_time", {"scenario" : scenario, "mover" : mover.__name__, "samples" : samples},
+                    lambda: utils.extrude_time(mover, tValues), repeat))
+
+    # Intersections are slow, so they're timed once.
+    for scenario, description in scenarios.items():
+        for samples in settings["intersectionSamples"][scenario]:
+            tValues = np.linspace(description["start"], 1.0, samples)
+            extruded = [utils.extrude_time(mover, tValues) for mover in description["movers"]]
+            results.append(measure("intersection", {"scenario" : scenario, "samples" : samples}, lambda: broadphase.intersection(*extruded)))
+
+    return results
+
+def compare(results, baseline, threshold=1.25):
+    # Return the results whose wall time or peak memory exceeds the matching baseline result by more than threshold.
+    baselineResults = {json.dumps([result["name"], result["parameters"]], sort_keys=True) : result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        key = json.dumps([result["name"], result["parameters"]], sort_keys=True)
+        if key not in baselineResults:
+            continue
+        reference = baselineResults[key]
+        timeRatio = result["wallTime"] / max(reference["wallTime"], 1.0e-9)
+        memoryRatio = result["peakMemory"] / max(reference["peakMemory"], 1)
+        logging.info(f"{result['name']} {result['parameters']}: time x{timeRatio:.2f}, memory x{memoryRatio:.2f}, boundaries {reference['boundaries']} -> {result['boundaries']}")
+        if timeRatio > threshold or memoryRatio > threshold:
+            regressions.append({"result" : result, "baseline" : reference, "timeRatio" : timeRatio, "memoryRatio" : memoryRatio})
+    return regressions
+
+def environment():
+    return {
+        "python" : platform.python_version(),
+        "platform" : platform.platform(),
+        "numpy" : np.__version__,
+        "bspy" : metadata.version("bspy"),
+        "date" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(module)s:%(lineno)d:%(message)s', datefmt='%H:%M:%S')
+
+    parser = argparse.ArgumentParser(description="Benchmark modeling, extrusion, and intersection scaling.")
+    parser.add_argument("--sweep", choices=sweeps.keys(), default="quick")
+    parser.add_argument("--repeat", type=int, default=3, help="untraced runs per case (best is kept)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="ratio over baseline reported as a regression")
+    parser.add_argument("--trace", help="Chrome trace file recording the pipeline stages of one more pass over the sweep")
+    args = parser.parse_args()
+
+    results = run(args.sweep, args.repeat)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump({"environment" : environment(), "sweep" : args.sweep, "results" : results}, file, indent=4)
+    logging.info(f"Saved {len(results)} results to {args.output}")
+
+    if args.trace:
+        with instrument.recording(args.trace):
+            run(args.sweep, 0)
+        logging.info(f"Saved trace of {len(instrument.events)} events to {args.trace}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            logging.warning(f"Regression: {regression['result']['name']} {regression['result']['parameters']} " +
+                f"time x{regression['timeRatio']:.2f}, memory x{regression['memoryRatio']:.2f}")
+        raise SystemExit(1 if regressions else 0)
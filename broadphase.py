@@ -0,0 +1,145 @@
+import numpy as np
+from bspy import Solid, Boundary, Manifold, Hyperplane
+import instrument
+import utils
+import intersections
+
+class BoundsIndex:
+    # Sweep-and-prune index over axis-aligned boxes, sorted by their lower bound along the sweep axis.
+    # For space-time extrusions the last axis is time, along which the slabs are naturally ordered.
+    def __init__(self, boxes, axis=-1, tolerance=Manifold.minSeparation):
+        self.boxes = np.array(boxes, float).reshape(len(boxes), -1, 2)
+        self.axis = axis
+        self.tolerance = tolerance
+        self.order = np.argsort(self.boxes[:, axis, 0], kind="stable")
+        self.sortedLower = self.boxes[self.order, axis, 0]
+
+    @staticmethod
+    def from_solid(solid):
+        boxes = np.empty((len(solid.boundaries), solid.dimension, 2))
+        for i, boundary in enumerate(solid.boundaries):
+            bounds = utils.boundary_bounds(boundary)
+            if bounds is None:
+                boxes[i, :, 0] = -np.inf
+                boxes[i, :, 1] = np.inf
+            else:
+                boxes[i] = bounds
+        return BoundsIndex(boxes)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def query(self, box):
+        # Return the indices of the boxes that overlap box (within tolerance).
+        if box is None:
+            return np.arange(len(self.boxes))
+        box = np.asarray(box)
+        end = np.searchsorted(self.sortedLower, box[self.axis, 1] + self.tolerance, side="right")
+        candidates = self.order[:end]
+        boxes = self.boxes[candidates]
+        overlaps = np.all((boxes[:, :, 0] <= box[:, 1] + self.tolerance) & (boxes[:, :, 1] >= box[:, 0] - self.tolerance), axis=1)
+        return np.sort(candidates[overlaps])
+
+def ray_directions(dimension, count=8):
+    # Generic directions, which avoid grazing the edges of axis-aligned domains: the first is fixed, the rest
+    # are random (but the same every time).
+    direction = np.sqrt((2.0, 3.0, 5.0, 7.0, 11.0, 13.0, 17.0, 19.0)[:dimension])
+    yield direction / np.linalg.norm(direction)
+    generator = np.random.default_rng(dimension)
+    for i in range(count - 1):
+        direction = generator.normal(size=dimension)
+        yield direction / np.linalg.norm(direction)
+
+def on_domain_edge(domain, point):
+    # Whether point (in domain coordinates) lies on the boundary of domain, where a ray crossing is ambiguous.
+    for boundary in domain.boundaries:
+        manifold = boundary.manifold
+        if not isinstance(manifold, Hyperplane):
+            return True
+        if abs(np.dot(manifold._normal, manifold._point - point)) < Manifold.minSeparation:
+            bounds = utils.boundary_bounds(boundary)
+            if bounds is None or not Solid.point_outside_bounds(point, bounds + (-Manifold.minSeparation, Manifold.minSeparation)):
+                return True
+    return False
+
+def ray_winding(solid, point, direction, halfEdges=False):
+    # Winding number of solid around point, counting the signed crossings of the boundaries by a ray from point:
+    # +1 leaving through a boundary, -1 entering. Returns None if point is on the boundary. If the ray hits a
+    # domain edge, returns nan (try another direction), or with halfEdges counts half a crossing for each
+    # boundary meeting there.
+    winding = 1 if solid.containsInfinity else 0
+    for boundary in solid.boundaries:
+        manifold = boundary.manifold
+        separation = np.dot(manifold._normal, manifold._point - point)
+        alignment = np.dot(manifold._normal, direction)
+        if -2.0 * Manifold.minSeparation < separation < Manifold.minSeparation:
+            if contains_point(boundary.domain, utils.hyperplane_domain_from_point(manifold, point)):
+                return None
+            continue
+        if abs(alignment) < Manifold.minSeparation or separation / alignment < 0.0:
+            continue
+        hit = utils.hyperplane_domain_from_point(manifold, point + (separation / alignment) * direction)
+        if on_domain_edge(boundary.domain, hit):
+            if not halfEdges:
+                return np.nan
+            winding += np.sign(alignment) / 2.0
+        elif contains_point(boundary.domain, hit):
+            winding += np.sign(alignment)
+    return winding
+
+def contains_point(solid, point):
+    # Point containment for hyperplane-bounded solids, as Solid.contains_point has it (on the boundary or winding
+    # number > 0.5), so the overlaps of parts added to one solid are inside. The winding number counts the signed
+    # crossings of a ray, recursing into boundary domains, which is much cheaper than the surface integral
+    # Solid.contains_point uses above dimension 1.
+    point = np.atleast_1d(point)
+    if solid.dimension <= 1 or not all(isinstance(boundary.manifold, Hyperplane) for boundary in solid.boundaries):
+        return solid.contains_point(point)
+    if Solid.point_outside_bounds(point, utils.solid_bounds(solid)):
+        return solid.containsInfinity
+    for direction in ray_directions(solid.dimension):
+        winding = ray_winding(solid, point, direction)
+        if winding is None or not np.isnan(winding):
+            break
+    else:
+        winding = ray_winding(solid, point, direction, True)
+    return winding is None or bool(winding > 0.5)
+
+def trim(boundary, box, other, otherIndex, cache):
+    # The part of boundary (with bounding box box) inside other, or None if there is none.
+    if len(otherIndex.query(box)) == 0:
+        # No overlapping boundaries, so the boundary is wholly inside or outside the other solid.
+        return boundary if contains_point(other, boundary.any_point()) else None
+    # Slice boundary manifold by the other solid and intersect the slice with the boundary's domain.
+    slice = other.slice(boundary.manifold, cache, True)
+    newDomain = boundary.domain.intersection(slice, cache)
+    return Boundary(boundary.manifold, newDomain) if newDomain else None
+
+@instrument.traced("broadphase.intersection")
+def intersection(solid1, solid2, cache = None):
+    # Intersect two solids like Solid.intersection, but use a bounds index over the boundaries of each solid
+    # to skip the exact slice for boundaries that overlap no boundary of the other solid.
+    # Such boundaries lie entirely inside or outside the other solid, so a point test classifies them whole.
+    # Manifold intersections are cached for this call, or in cache if given (a dict or an IntersectionCache).
+    assert solid1.dimension == solid2.dimension
+    cache = intersections.cache_view(cache)
+    combinedSolid = Solid(solid1.dimension, solid1.containsInfinity and solid2.containsInfinity)
+    bounds1 = utils.solid_bounds(solid1)
+    bounds2 = utils.solid_bounds(solid2)
+    if Solid.disjoint_bounds(bounds1, bounds2):
+        if solid2.containsInfinity:
+            for boundary in solid1.boundaries:
+                combinedSolid.add_boundary(boundary)
+        if solid1.containsInfinity:
+            for boundary in solid2.boundaries:
+                combinedSolid.add_boundary(boundary)
+        return combinedSolid
+
+    index1 = BoundsIndex.from_solid(solid1)
+    index2 = BoundsIndex.from_solid(solid2)
+    for solid, index, other, otherIndex in ((solid1, index1, solid2, index2), (solid2, index2, solid1, index1)):
+        for boundary, box in zip(solid.boundaries, index.boxes):
+            trimmed = trim(boundary, box, other, otherIndex, cache)
+            if trimmed is not None:
+                combinedSolid.add_boundary(trimmed)
+    return combinedSolid
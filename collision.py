@@ -0,0 +1,127 @@
+import functools
+import logging
+import numpy as np
+from bspy import Solid
+import utils
+import broadphase
+import parallel
+import instrument
+import intersections
+
+# Collision queries between moving assemblies that stop at the earliest contact instead of building the whole
+# space-time intersection.
+
+@instrument.traced("first_contact")
+def first_contact(extruded1, extruded2, cache=None):
+    # Earliest contact between two space-time solids (such as extrude_time results), as (t, point), or None.
+    # t is the earliest time in their intersection, and point is a (x, y, z, t) witness in the intersection at
+    # time t: the vertex of the earliest piece with the smallest t. The boundaries of both solids are trimmed in
+    # order of their earliest possible time, stopping once no remaining boundary can start before the contact
+    # found so far.
+    assert extruded1.dimension == extruded2.dimension
+    cache = intersections.cache_view(cache)
+    bounds1 = utils.solid_bounds(extruded1)
+    bounds2 = utils.solid_bounds(extruded2)
+    if bounds1 is not None and bounds2 is not None and Solid.disjoint_bounds(bounds1, bounds2):
+        return None
+
+    # Cheap bounds first: only boundaries whose box overlaps the other solid's box can touch it.
+    index1 = broadphase.BoundsIndex.from_solid(extruded1)
+    index2 = broadphase.BoundsIndex.from_solid(extruded2)
+    candidates = []
+    for solid, index, other, otherIndex, otherBounds in ((extruded1, index1, extruded2, index2, bounds2), (extruded2, index2, extruded1, index1, bounds1)):
+        for boundary, box in zip(solid.boundaries, index.boxes):
+            if otherBounds is None or not Solid.disjoint_bounds(box, otherBounds):
+                candidates.append((box[-1, 0], boundary, box, other, otherIndex))
+    candidates.sort(key=lambda candidate: candidate[0])
+
+    contact = None
+    for tStart, boundary, box, other, otherIndex in candidates:
+        if contact is not None and tStart >= contact[0]:
+            break
+        trimmed = broadphase.trim(boundary, box, other, otherIndex, cache)
+        if trimmed is None:
+            continue
+        vertices = utils.boundary_vertices(trimmed) if not trimmed.domain.containsInfinity else ()
+        if len(vertices) > 0:
+            point = vertices[np.argmin(vertices[:, -1])]
+        else:
+            # Unbounded piece: any point of it is a witness, at its own time.
+            point = np.asarray(trimmed.any_point())
+        if contact is None or point[-1] < contact[0]:
+            contact = (point[-1], point)
+    return contact
+
+def collides(extruded1, extruded2, cache=None):
+    return first_contact(extruded1, extruded2, cache) is not None
+
+@instrument.traced("first_contact_in_slabs")
+def first_contact_in_slabs(solidFunction1, tValues1, solidFunction2, tValues2, tolerance=None):
+    # Earliest contact between two movers, extruding and checking one time slab at a time (the merged breakpoints
+    # of tValues1 and tValues2), so nothing after the first colliding slab is extruded. Each mover is only sampled
+    # at its own tValues (see parallel.sample_at), unless tolerance adapts the samples to the motion anyway.
+    function1 = functools.partial(parallel.sample_at, solidFunction1, tuple(tValues1)) if tolerance is None else solidFunction1
+    function2 = functools.partial(parallel.sample_at, solidFunction2, tuple(tValues2)) if tolerance is None else solidFunction2
+    for group in parallel.slab_groups(tValues1, tValues2):
+        extruded1 = utils.extrude_time(function1, parallel.restrict_time_values(tValues1, group[0], group[-1]), tolerance)
+        extruded2 = utils.extrude_time(function2, parallel.restrict_time_values(tValues2, group[0], group[-1]), tolerance)
+        contact = first_contact(extruded1, extruded2)
+        if contact is not None:
+            return contact
+    return None
+
+def coarse_drift(solidFunction, tValues):
+    # How far the fine extrusion over tValues strays from the one-slab extrusion from tValues[0] to tValues[-1].
+    # Both move linearly within each fine slab, so checking the ends of the fine slabs is enough.
+    start = solidFunction(tValues[0])
+    drift = 0.0
+    for t, tNext in zip(tValues[:-1], tValues[1:]):
+        sample = solidFunction(t)
+        drift = max(drift, utils.interpolation_drift(start, sample, t - tValues[0]), utils.interpolation_drift(start, sample, tNext - tValues[0], tNext - t))
+    return drift
+
+def padded_extrusion(solidFunction, tValues):
+    # One slab over tValues[0] to tValues[-1], padded by its drift so it covers the fine extrusion over tValues,
+    # or None if the samples aren't made of right-angled parts, which offset_solid can't pad exactly. (Samples
+    # aren't merged, since merged faces have non-convex domains.)
+    if not all(utils.right_angled(solidFunction(t)) for t in (tValues[0], tValues[-1])):
+        return None
+    drift = coarse_drift(solidFunction, tValues)
+    return utils.extrude_time(lambda t: utils.offset_solid(solidFunction(t), drift), (tValues[0], tValues[-1]), merge=False)
+
+@instrument.traced("refined_intersection")
+def refined_intersection(solidFunction1, tValues1, solidFunction2, tValues2, groupSize=4, merge=True, cache=None):
+    # Intersect the time extrusions of two movers coarse to fine. Each group of groupSize merged slabs is first
+    # checked as one padded slab per mover, which covers the fine extrusions over the group. Groups without contact
+    # are skipped; in the others, slabs that end before the padded contact are skipped too, and the rest are
+    # extruded and intersected slab by slab (merging samples if merge). Movers with parts that aren't right-angled
+    # (see utils.right_angled) can't be padded, so all their slabs are intersected. The result matches
+    # parallel.intersect_extrusions over the same tValues. Manifold intersections go in cache, if given.
+    samples = {}
+    def sampled(solidFunction):
+        def sampledFunction(t):
+            if (solidFunction, t) not in samples:
+                samples[solidFunction, t] = solidFunction(t)
+            return samples[solidFunction, t]
+        return sampledFunction
+    # Each mover is only sampled at its own tValues (see parallel.sample_at).
+    function1 = sampled(functools.partial(parallel.sample_at, solidFunction1, tuple(tValues1)))
+    function2 = sampled(functools.partial(parallel.sample_at, solidFunction2, tuple(tValues2)))
+
+    pieces = []
+    for group in parallel.slab_groups(tValues1, tValues2, groupSize):
+        padded1 = padded_extrusion(function1, group) if len(group) > 2 else None
+        padded2 = padded_extrusion(function2, group) if padded1 is not None else None
+        contact = first_contact(padded1, padded2, cache) if padded2 is not None else (group[0],)
+        if contact is None:
+            logging.info(f"No contact from {group[0]:.3f} to {group[-1]:.3f}")
+            continue
+        for start, end in zip(group[:-1], group[1:]):
+            if end < contact[0]:
+                continue
+            solid = parallel.intersect_slabs(function1, (start, end), function2, (start, end), merge, cache)
+            if solid:
+                pieces.append((start, end, solid))
+    # Only pieces from adjacent slabs share caps.
+    seams = [start for (previousStart, previousEnd, previous), (start, end, solid) in zip(pieces, pieces[1:]) if previousEnd == start]
+    return parallel.stitch_slabs([piece[2] for piece in pieces], seams) if pieces else Solid(solidFunction1(tValues1[0]).dimension + 1, False)
@@ -0,0 +1,186 @@
+import logging
+import numpy as np
+
+class Dual:
+    # Forward-mode dual number: a value (scalar or array) and its exact rate with respect to one variable (typically t).
+    # Parameter functions written with arithmetic, powers, abs, comparisons, common numpy functions (np.sin, np.cos,
+    # np.exp, np.arctan2, np.minimum, ...), np.where, np.clip, and np.interp work unchanged on duals. Functions that
+    # reject duals get finite-difference rates instead (see call).
+
+    def __init__(self, value, derivative=0.0):
+        self.value = value
+        self.derivative = derivative
+
+    def __repr__(self):
+        return "Dual({0}, {1})".format(self.value, self.derivative)
+
+    def __add__(self, other):
+        return Dual(self.value + value(other), self.derivative + derivative(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Dual(self.value - value(other), self.derivative - derivative(other))
+
+    def __rsub__(self, other):
+        return Dual(value(other) - self.value, derivative(other) - self.derivative)
+
+    def __mul__(self, other):
+        return Dual(self.value * value(other), self.derivative * value(other) + self.value * derivative(other))
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        return Dual(self.value / value(other), (self.derivative * value(other) - self.value * derivative(other)) / (value(other) * value(other)))
+
+    def __rtruediv__(self, other):
+        return Dual(value(other) / self.value, (derivative(other) * self.value - value(other) * self.derivative) / (self.value * self.value))
+
+    def __pow__(self, other):
+        power = self.value ** value(other)
+        rate = value(other) * self.value ** (value(other) - 1) * self.derivative
+        if isinstance(other, Dual):
+            rate = rate + power * np.log(self.value) * other.derivative
+        return Dual(power, rate)
+
+    def __rpow__(self, other):
+        power = value(other) ** self.value
+        return Dual(power, power * np.log(value(other)) * self.derivative)
+
+    def __abs__(self):
+        return Dual(np.abs(self.value), np.sign(self.value) * self.derivative)
+
+    def __neg__(self):
+        return Dual(-self.value, -self.derivative)
+
+    def __pos__(self):
+        return self
+
+    # Comparisons only consider values, so they select branches like they would for plain numbers.
+    def __lt__(self, other):
+        return self.value < value(other)
+
+    def __le__(self, other):
+        return self.value <= value(other)
+
+    def __gt__(self, other):
+        return self.value > value(other)
+
+    def __ge__(self, other):
+        return self.value >= value(other)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != "__call__" or kwargs:
+            return NotImplemented
+        if ufunc in _binaryOperators:
+            a, b = inputs
+            operator, reflected = _binaryOperators[ufunc]
+            return operator(a, b) if isinstance(a, Dual) else reflected(b, a)
+        elif ufunc in _selections:
+            a, b = inputs
+            choice = _selections[ufunc](value(a), value(b))
+            return Dual(np.where(choice, value(a), value(b)), np.where(choice, derivative(a), derivative(b)))
+        elif ufunc in _unaryRates:
+            [x] = inputs
+            return Dual(ufunc(x.value), _unaryRates[ufunc](x.value) * x.derivative)
+        elif ufunc in _comparisons:
+            return ufunc(*(value(item) for item in inputs))
+        return NotImplemented
+
+    def __array_function__(self, func, types, args, kwargs):
+        if func is np.where:
+            condition, x, y = args
+            return Dual(np.where(condition, value(x), value(y)), np.where(condition, derivative(x), derivative(y)))
+        elif func is np.clip:
+            x, lower, upper = args
+            x = x if lower is None else np.maximum(x, lower)
+            return x if upper is None else np.minimum(x, upper)
+        elif func is np.interp:
+            x, xp, fp = args
+            xp = np.asarray(xp, float)
+            fp = np.asarray(fp, float)
+            # Slope of the segment containing x (right-hand at breakpoints), zero where interp clamps.
+            slopes = np.append(np.diff(fp) / np.diff(xp), 0.0)
+            segment = np.searchsorted(xp, value(x), side="right") - 1
+            slope = np.where(segment < 0, 0.0, slopes[np.clip(segment, 0, len(slopes) - 1)])
+            return Dual(np.interp(value(x), xp, fp), slope * derivative(x))
+        return NotImplemented
+
+def _arctan2(y, x):
+    y, x = (item if isinstance(item, Dual) else Dual(item) for item in (y, x))
+    return Dual(np.arctan2(y.value, x.value), (x.value * y.derivative - y.value * x.derivative) / (x.value * x.value + y.value * y.value))
+
+# Each binary ufunc's operator for a dual first argument and (reflected) for a dual second argument only.
+_binaryOperators = {
+    np.add : (Dual.__add__, Dual.__radd__),
+    np.subtract : (Dual.__sub__, Dual.__rsub__),
+    np.multiply : (Dual.__mul__, Dual.__rmul__),
+    np.true_divide : (Dual.__truediv__, Dual.__rtruediv__),
+    np.power : (Dual.__pow__, Dual.__rpow__),
+    np.arctan2 : (_arctan2, lambda x, y: _arctan2(y, x)),
+}
+
+# Ufuncs that pick one of their arguments (and its rate), where the comparison holds for the first.
+_selections = {
+    np.minimum : np.less_equal,
+    np.maximum : np.greater_equal,
+}
+
+_unaryRates = {
+    np.negative : lambda x: -1.0,
+    np.positive : lambda x: 1.0,
+    np.sin : np.cos,
+    np.cos : lambda x: -np.sin(x),
+    np.tan : lambda x: 1.0 / np.cos(x)**2,
+    np.exp : np.exp,
+    np.log : lambda x: 1.0 / x,
+    np.sqrt : lambda x: 0.5 / np.sqrt(x),
+    np.absolute : np.sign,
+}
+
+_comparisons = (np.less, np.less_equal, np.greater, np.greater_equal, np.equal, np.not_equal)
+
+def value(x):
+    return x.value if isinstance(x, Dual) else x
+
+def derivative(x):
+    return x.derivative if isinstance(x, Dual) else np.zeros_like(x, float)
+
+def split(x):
+    # Split a (possibly nested tuple of) dual(s) into matching values and rates. Plain numbers have zero rates.
+    if isinstance(x, (tuple, list)):
+        pairs = [split(item) for item in x]
+        return tuple(pair[0] for pair in pairs), tuple(pair[1] for pair in pairs)
+    else:
+        return value(x), derivative(x)
+
+def combine(values, rates):
+    # The inverse of split: a (possibly nested tuple of) dual(s) from matching values and rates.
+    if isinstance(values, (tuple, list)):
+        return tuple(combine(item, rate) for item, rate in zip(values, rates))
+    else:
+        return Dual(values, rates)
+
+def difference(high, low, step):
+    if isinstance(high, (tuple, list)):
+        return tuple(difference(a, b, step) for a, b in zip(high, low))
+    else:
+        return (np.asarray(high, float) - np.asarray(low, float)) / step
+
+def call(function, t):
+    # Call function with the dual of t (scalar or array) and return its result. A function that rejects duals
+    # (raising TypeError, as math.sin or an unsupported numpy function does) is called with plain numbers instead,
+    # and its rates are central finite differences.
+    try:
+        return function(Dual(t, np.ones_like(t, float)))
+    except TypeError as error:
+        logging.warning(f"{getattr(function, '__name__', function)} doesn't take dual numbers ({error}), so its rates are finite differences")
+    step = 1.0e-6 * np.maximum(1.0, np.abs(t))
+    return combine(function(t), difference(function(t + step), function(t - step), 2.0 * step))
+
+def evaluate(function, t):
+    # Evaluate function at t (scalar or array), returning its values and their rates with respect to t (see call).
+    # Constant (non-callable) parameters have zero rates.
+    if not callable(function):
+        return split(function)
+    return split(call(function, t))
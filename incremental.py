@@ -0,0 +1,98 @@
+import logging
+from bspy import Solid
+import utils
+import broadphase
+import parallel
+import instrument
+import intersections
+
+# Time extrusions and intersections kept slab by slab, so that editing a mover's motion over part of the
+# timeline only redoes the slabs that edit touches.
+#
+# extrusion = SlabExtrusion(robot1, tValues)
+# intersection = SlabIntersection(SlabExtrusion(robot1, tValues), SlabExtrusion(robot2, tValues))
+# intersection.edit(0, tuned_robot1, 0.75, 1.0)   # Only the slabs from 0.75 on are extruded and intersected again.
+
+class SlabExtrusion:
+    # The extrusion of solidFunction over tValues, as one extrude_time solid per slab plus the sample at each
+    # slab end. The slabs share their end samples, so stitching them gives the extrusion over all of tValues.
+    # With sampleValues (the mover's own samples, when tValues also has another mover's), solidFunction is only
+    # sampled at those, and the slab ends between them are advanced from the previous one (see parallel.sample_at).
+    def __init__(self, solidFunction, tValues, sampleValues=None):
+        assert len(tValues) >= 2
+        self.solidFunction = solidFunction
+        self.tValues = tuple(float(t) for t in tValues)
+        self.sampleValues = None if sampleValues is None else tuple(float(t) for t in sampleValues)
+        self.samples = {}
+        self.slabs = [self.extrude_slab(i) for i in range(len(self.tValues) - 1)]
+
+    def sample(self, t):
+        if t not in self.samples:
+            self.samples[t] = self.solidFunction(t) if self.sampleValues is None else parallel.sample_at(self.solidFunction, self.sampleValues, t)
+        return self.samples[t]
+
+    def source(self, t):
+        # The time solidFunction is sampled at for the slab end at t.
+        if self.sampleValues is None or t in self.sampleValues:
+            return t
+        previous = [tValue for tValue in self.sampleValues if tValue < t]
+        return previous[-1] if previous else t
+
+    def extrude_slab(self, i):
+        return utils.extrude_time(self.sample, self.tValues[i:i + 2])
+
+    def overlapping_slabs(self, t0, t1):
+        # Slabs with a point (or an end sample) in [t0, t1].
+        return [i for i in range(len(self.slabs)) if self.tValues[i] <= t1 and self.tValues[i + 1] >= t0]
+
+    @instrument.traced("SlabExtrusion.edit")
+    def edit(self, solidFunction, t0, t1):
+        # Switch to solidFunction, which differs from the current one only over [t0, t1], and extrude again just
+        # the slabs that overlap it. Returns the indices of the slabs that changed.
+        self.solidFunction = solidFunction
+        stale = [t for t in self.tValues if t0 <= self.source(t) <= t1]
+        for t in stale:
+            self.samples.pop(t, None)
+        changed = self.overlapping_slabs(t0, max([t1] + stale))
+        for i in changed:
+            self.slabs[i] = self.extrude_slab(i)
+        logging.info(f"Extruded {len(changed)} of {len(self.slabs)} slabs again")
+        return changed
+
+    def solid(self):
+        return parallel.stitch_slabs(self.slabs, self.tValues[1:-1])
+
+class SlabIntersection:
+    # The intersection of two slab extrusions over the same tValues (such as the merged tValues of both movers),
+    # kept as one piece per slab. The stitched result matches parallel.intersect_extrusions.
+    def __init__(self, extrusion1, extrusion2):
+        assert extrusion1.tValues == extrusion2.tValues
+        self.extrusions = [extrusion1, extrusion2]
+        self.pieces = [self.intersect_slab(i) for i in range(len(extrusion1.slabs))]
+
+    def intersect_slab(self, i):
+        # Manifold intersections are shared between slabs and edits (see intersections).
+        return broadphase.intersection(self.extrusions[0].slabs[i], self.extrusions[1].slabs[i], intersections.shared)
+
+    @instrument.traced("SlabIntersection.edit")
+    def edit(self, which, solidFunction, t0, t1):
+        # Edit the motion of extrusion which (0 or 1) over [t0, t1] and intersect again only the slabs it changed.
+        changed = self.extrusions[which].edit(solidFunction, t0, t1)
+        for i in changed:
+            self.pieces[i] = self.intersect_slab(i)
+        return changed
+
+    def solid(self):
+        # Caps are only shared between non-empty pieces of adjacent slabs.
+        tValues = self.extrusions[0].tValues
+        pieces = [(i, piece) for i, piece in enumerate(self.pieces) if piece]
+        if not pieces:
+            return Solid(self.extrusions[0].slabs[0].dimension, False)
+        seams = [tValues[i] for (previous, previousPiece), (i, piece) in zip(pieces, pieces[1:]) if previous + 1 == i]
+        return parallel.stitch_slabs([piece for i, piece in pieces], seams)
+
+def slab_intersection(solidFunction1, tValues1, solidFunction2, tValues2):
+    # SlabIntersection of two movers over the merged tValues of both, the slabs parallel.intersect_extrusions uses.
+    # Each mover is only sampled at its own tValues.
+    breakpoints = sorted(set(tValues1) | set(tValues2))
+    return SlabIntersection(SlabExtrusion(solidFunction1, breakpoints, tValues1), SlabExtrusion(solidFunction2, breakpoints, tValues2))
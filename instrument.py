@@ -0,0 +1,118 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from bspy import Solid
+
+# Opt-in instrumentation for the modeling pipeline. Pipeline functions are wrapped with @traced(name); while recording
+# is enabled each call adds a Chrome trace event (chrome://tracing or https://ui.perfetto.dev) with its wall time,
+# the boundaries it produced, and its recursion depth. When disabled, a traced call costs one flag check.
+#
+# with instrument.recording("trace.json"):
+#     intersection = broadphase.intersection(extrudedRobot, extrudedRouter)
+#
+# Only the calling process is recorded; work done in ProcessPoolExecutor workers shows up as the parent's wait.
+
+enabled = False
+events = []
+_local = threading.local()
+_origin = time.perf_counter()
+
+def count_boundaries(result):
+    if isinstance(result, Solid):
+        return len(result.boundaries)
+    elif isinstance(result, (list, tuple)):
+        return sum(count_boundaries(item) for item in result)
+    return None
+
+@contextmanager
+def stage(name, **args):
+    # Record the enclosed block as an event named name. Callers may add entries to the yielded args dict.
+    if not enabled:
+        yield args
+        return
+    depths = _local.__dict__.setdefault("depths", {})
+    depth = depths.get(name, 0)
+    depths[name] = depth + 1
+    args["depth"] = depth
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter()
+        depths[name] = depth
+        events.append({"name" : name, "cat" : "modeler", "ph" : "X", "ts" : (start - _origin) * 1.0e6, "dur" : (end - start) * 1.0e6,
+            "pid" : os.getpid(), "tid" : threading.get_ident(), "args" : args})
+
+def traced(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with stage(name) as record:
+                result = function(*args, **kwargs)
+                record["boundaries"] = count_boundaries(result)
+            return result
+        return wrapper
+    return decorate
+
+def start():
+    global enabled
+    enabled = True
+
+def stop():
+    global enabled
+    enabled = False
+
+def clear():
+    events.clear()
+
+def summary():
+    # Per stage: call count, total and self wall time (seconds), boundaries produced, and deepest recursion.
+    # Recursive calls nest inside their caller, so only outermost calls count toward wallTime.
+    # Self time excludes the time of directly nested events.
+    stages = {}
+    stack = []
+    for event in sorted(events, key=lambda event: (event["pid"], event["tid"], event["ts"], -event["dur"])):
+        entry = stages.setdefault(event["name"], {"calls" : 0, "wallTime" : 0.0, "selfTime" : 0.0, "boundaries" : 0, "maxDepth" : 0})
+        entry["calls"] += 1
+        if event["args"]["depth"] == 0:
+            entry["wallTime"] += event["dur"] * 1.0e-6
+        entry["selfTime"] += event["dur"] * 1.0e-6
+        entry["boundaries"] += event["args"].get("boundaries") or 0
+        entry["maxDepth"] = max(entry["maxDepth"], event["args"]["depth"])
+        while stack and ((stack[-1]["pid"], stack[-1]["tid"]) != (event["pid"], event["tid"]) or stack[-1]["ts"] + stack[-1]["dur"] <= event["ts"]):
+            stack.pop()
+        if stack:
+            stages[stack[-1]["name"]]["selfTime"] -= event["dur"] * 1.0e-6
+        stack.append(event)
+    return stages
+
+def save(fileName):
+    with open(fileName, "w", encoding="utf-8") as file:
+        json.dump({"traceEvents" : events, "displayTimeUnit" : "ms", "otherData" : {"summary" : summary()}}, file)
+
+def _patch_bspy():
+    # bspy's Solid.slice and Solid.intersection are traced by wrapping them for the duration of a recording.
+    originals = {name : getattr(Solid, name) for name in ("slice", "intersection")}
+    for name, method in originals.items():
+        setattr(Solid, name, traced("Solid." + name)(method))
+    return originals
+
+@contextmanager
+def recording(fileName=None, bspyCalls=True):
+    # Record events for the enclosed block, writing them to fileName (if given) at the end.
+    clear()
+    originals = _patch_bspy() if bspyCalls else {}
+    start()
+    try:
+        yield events
+    finally:
+        stop()
+        for name, method in originals.items():
+            setattr(Solid, name, method)
+        if fileName is not None:
+            save(fileName)
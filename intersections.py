@@ -0,0 +1,107 @@
+from collections import OrderedDict
+import numpy as np
+from bspy import Hyperplane
+
+# Manifold intersections cached across bspy calls (frames, time samples, slabs, repeated intersections).
+#
+# bspy's cache argument is a dict keyed by pairs of manifold objects, so it only helps within one call. Here pairs
+# of hyperplanes are keyed by their geometry instead: both normals and tangent spaces and the offset between their
+# points. Hyperplane.intersect only depends on these (it solves for the offset between the points), so the key
+# also matches pairs moved together, like static parts in every frame or in every time slab of an extrusion.
+#
+# cache = IntersectionCache()
+# solid1.intersection(solid2, cache.view())
+# broadphase.intersection(solid1, solid2, intersections.shared)
+#
+# Nothing uses the shared cache unless it's passed in, since it keeps its entries (bspy solids and manifolds)
+# until they're evicted or cleared. The pipeline and incremental intersections pass intersections.shared.
+#
+# Pass a fresh view to each bspy call. bspy also uses its cache to tell which of a pair of twin intersections
+# (self with other, other with self) came first in that call, and a view keeps that bookkeeping per call.
+
+def pair_key(manifold, other):
+    if not isinstance(manifold, Hyperplane) or not isinstance(other, Hyperplane):
+        return None
+    return (np.shape(manifold._tangentSpace), manifold._normal.tobytes(), np.asarray(manifold._tangentSpace, float).tobytes(),
+        other._normal.tobytes(), np.asarray(other._tangentSpace, float).tobytes(), (other._point - manifold._point).tobytes())
+
+class IntersectionCache:
+    # Size-bounded (least recently used) store of manifold-pair intersections.
+    def __init__(self, maxSize=65536):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.statistics = {"hits" : 0, "misses" : 0, "evictions" : 0}
+
+    def view(self):
+        return CacheView(self)
+
+    def lookup(self, key):
+        if key in self.entries:
+            self.statistics["hits"] += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.statistics["misses"] += 1
+        return None
+
+    def store(self, key, intersections):
+        self.entries[key] = intersections
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+            self.statistics["evictions"] += 1
+
+    def info(self):
+        return dict(self.statistics, size=len(self.entries), maxSize=self.maxSize)
+
+    def clear(self):
+        self.entries.clear()
+        self.statistics.update(hits=0, misses=0, evictions=0)
+
+class CacheView:
+    # The dict bspy sees for one call. Manifold.cached_intersect first looks up (other, manifold), to find a twin
+    # computed earlier in the call, and then (manifold, other). Only the second lookup is answered from the shared
+    # cache, and the answer is then remembered for the rest of the call, just as bspy would store it.
+    def __init__(self, cache):
+        self.cache = cache
+        self.session = {}
+        self.lastMiss = None
+
+    def get(self, key, default=None):
+        if key in self.session:
+            self.lastMiss = None
+            return self.session[key]
+        manifold, other = key
+        if self.lastMiss is not None and self.lastMiss[0] is other and self.lastMiss[1] is manifold:
+            self.lastMiss = None
+            geometricKey = pair_key(manifold, other)
+            intersections = None if geometricKey is None else self.cache.lookup(geometricKey)
+            if intersections is not None:
+                self.session[key] = intersections
+                return intersections
+            return default
+        self.lastMiss = key
+        return default
+
+    def __getitem__(self, key):
+        return self.session[key]
+
+    def __setitem__(self, key, intersections):
+        self.session[key] = intersections
+        geometricKey = pair_key(*key)
+        if geometricKey is not None:
+            self.cache.store(geometricKey, intersections)
+
+    def __contains__(self, key):
+        return key in self.session
+
+    def __len__(self):
+        return len(self.session)
+
+shared = IntersectionCache()
+
+def cache_view(cache=None):
+    # The cache to pass to one bspy call: a new dict by default, a view of cache if it's an IntersectionCache
+    # (such as intersections.shared), or cache itself if it's a plain dict.
+    if cache is None:
+        return {}
+    return cache.view() if isinstance(cache, IntersectionCache) else cache
@@ -1,8 +1,16 @@
 import numpy as np
-from bspy import Solid, Manifold, Boundary
+from bspy import Solid, Manifold, Boundary, Hyperplane
+import dual
+import instrument
+import planar
+import utils
 
 class Modeler:
-    def __init__(self):
+    # Parameters may be dual numbers (dual.Dual), in which case their rates are used in place of the explicit rates.
+    # Pass a count to model count samples at once (such as count time values). The matrices then become stacks
+    # of shape (count, 4, 4), operations take arrays of count parameters, and transform returns a list of count results.
+    def __init__(self, count=None):
+        self.count = count
         self.matrixStack = []
         self.reset()
     
@@ -10,13 +18,16 @@ class Modeler:
         return self.matrix
 
     def reset(self):
-        self.matrix = np.identity(4)
-        self.dMatrix = np.zeros((4, 4))
-        self.dMatrix[3,3] = 1.0
+        shape = () if self.count is None else (self.count,)
+        self.matrix = np.broadcast_to(np.identity(4), shape + (4, 4)).copy()
+        self.dMatrix = np.zeros(shape + (4, 4))
+        self.dMatrix[..., 3, 3] = 1.0
+        self._matrixInverseTranspose = None
     
     def pop(self):
         if self.matrixStack:
             self.matrix, self.dMatrix = self.matrixStack.pop()
+            self._matrixInverseTranspose = None
         else:
             self.reset()
 
@@ -25,11 +36,32 @@ class Modeler:
 
     def multiply(self, matrix, dMatrix):
         newMatrix = self.matrix @ matrix
-        newDMatrix = self.dMatrix[:3,:3] @ matrix[:3,:3] + self.matrix[:3,:3] @ dMatrix[:3,:3]
-        newDVector = self.dMatrix[:3,:3] @ matrix[:3, 3] + self.matrix[:3,:3] @ dMatrix[:3, 3]
+        newDMatrix = np.zeros(newMatrix.shape)
+        newDMatrix[..., 3, 3] = 1.0
+        newDMatrix[..., :3, :3] = self.dMatrix[..., :3, :3] @ matrix[..., :3, :3] + self.matrix[..., :3, :3] @ dMatrix[..., :3, :3]
+        newDVector = self.dMatrix[..., :3, :3] @ matrix[..., :3, 3:] + self.matrix[..., :3, :3] @ dMatrix[..., :3, 3:]
+        newDMatrix[..., :3, 3] = self.dMatrix[..., :3, 3] + newDVector[..., 0]
         self.matrix = newMatrix
-        self.dMatrix[:3,:3] = newDMatrix
-        self.dMatrix[:3,3] += newDVector
+        self.dMatrix = newDMatrix
+        self._matrixInverseTranspose = None
+
+    def matrix_inverse_transpose(self):
+        # The inverse transpose transforms normals. It's computed once per matrix.
+        if self._matrixInverseTranspose is None:
+            self._matrixInverseTranspose = np.swapaxes(np.linalg.inv(self.matrix[..., :3, :3]), -1, -2)
+        return self._matrixInverseTranspose
+
+    def sample(self, index):
+        # Return a single-sample Modeler for one sample of a batched Modeler.
+        modeler = Modeler()
+        modeler.matrix = self.matrix[index].copy()
+        modeler.dMatrix = self.dMatrix[index].copy()
+        return modeler
+
+    @staticmethod
+    def components(v):
+        # Stack the components of v (scalars or arrays of samples) along the last axis.
+        return np.stack(np.broadcast_arrays(*[np.asarray(value, float) for value in v]), axis=-1)
 
     def rotate(self, axis, radians, dRadians=0.0):
         self.multiply(*self.rotation(axis, radians, dRadians))
@@ -41,12 +73,15 @@ class Modeler:
             [[0, 2, 0, 2], [0, 0, 2, 2]],
             [[0, 0, 1, 1], [0, 1, 0, 1]]
         ]
-        matrix = np.identity(4)
-        matrix[indices[axis][0], indices[axis][1]] = np.array((np.cos(radians), -np.sin(radians), np.sin(radians), np.cos(radians)))
+        if isinstance(radians, dual.Dual):
+            radians, dRadians = dual.split(radians)
+        radians, dRadians = np.broadcast_arrays(np.asarray(radians, float), np.asarray(dRadians, float))
+        matrix = np.broadcast_to(np.identity(4), radians.shape + (4, 4)).copy()
+        matrix[..., indices[axis][0], indices[axis][1]] = np.stack((np.cos(radians), -np.sin(radians), np.sin(radians), np.cos(radians)), axis=-1)
 
-        dMatrix = np.zeros((4, 4))
-        dMatrix[3,3] = 1.0
-        dMatrix[indices[axis][0], indices[axis][1]] = dRadians * np.array((-np.sin(radians), -np.cos(radians), np.cos(radians), -np.sin(radians)))
+        dMatrix = np.zeros(radians.shape + (4, 4))
+        dMatrix[..., 3, 3] = 1.0
+        dMatrix[..., indices[axis][0], indices[axis][1]] = dRadians[..., np.newaxis] * np.stack((-np.sin(radians), -np.cos(radians), np.cos(radians), -np.sin(radians)), axis=-1)
 
         return matrix, dMatrix
 
@@ -55,22 +90,39 @@ class Modeler:
     
     @staticmethod
     def scaling(v, dV=(0.0, 0.0, 0.0)):
-        matrix = np.identity(4)
-        for i in range(min(len(v), 3)):
-            matrix[i, i] = v[i]
+        if any(isinstance(value, dual.Dual) for value in v):
+            v, dV = dual.split(tuple(v))
+        v = Modeler.components(v[:3])
+        dV = Modeler.components(dV[:3])
+        shape = np.broadcast_shapes(v.shape[:-1], dV.shape[:-1])
+        matrix = np.broadcast_to(np.identity(4), shape + (4, 4)).copy()
+        for i in range(v.shape[-1]):
+            matrix[..., i, i] = v[..., i]
 
-        dMatrix = np.zeros((4, 4))
-        dMatrix[3,3] = 1.0
-        for i in range(min(len(dV), 3)):
-            dMatrix[i, i] = dV[i]
+        dMatrix = np.zeros(shape + (4, 4))
+        dMatrix[..., 3, 3] = 1.0
+        for i in range(dV.shape[-1]):
+            dMatrix[..., i, i] = dV[..., i]
 
         return matrix, dMatrix
 
+    @instrument.traced("Modeler.transform")
     def transform(self, *args):
         values = args if np.isscalar(args[0]) else args[0]
-        if isinstance(values, (Solid, Boundary, Manifold)):
+        if isinstance(values, planar.PlanarSolid):
+            return self.transform_planar(values)
+        elif isinstance(values, (Solid, Boundary, Manifold)) and self.count is not None:
+            if isinstance(values, Solid):
+                solids = [Solid(values.dimension, values.containsInfinity) for i in range(self.count)]
+                for solid, boundaries in zip(solids, self.transform_boundaries(values.boundaries)):
+                    for boundary in boundaries:
+                        solid.add_boundary(boundary)
+                return solids
+            else:
+                return [self.sample(i).transform(values) for i in range(self.count)]
+        elif isinstance(values, (Solid, Boundary, Manifold)):
             matrix = self.matrix[:3, :3]
-            matrixInverseTranspose = np.transpose(np.linalg.inv(matrix))
+            matrixInverseTranspose = self.matrix_inverse_transpose()
             translation = self.matrix[:3, 3]
             def transformManifold(manifold):
                 transformedManifold = manifold.transform(matrix, matrixInverseTranspose).translate(translation)
@@ -79,8 +131,8 @@ class Modeler:
             
             if isinstance(values, Solid):
                 solid = Solid(values.dimension, values.containsInfinity)
-                for boundary in values.boundaries:
-                    solid.add_boundary(Boundary(transformManifold(boundary.manifold), boundary.domain))
+                for boundary in self.transform_boundaries(values.boundaries):
+                    solid.add_boundary(boundary)
                 return solid
             elif isinstance(values, Boundary):
                 return Boundary(transformManifold(values.manifold), values.domain)
@@ -93,18 +145,79 @@ class Modeler:
             vector[3] = 1.0
             return self.matrix @ vector
 
+    def transform_hyperplanes(self, normals, points, tangentSpaces):
+        # Transform stacked 3D hyperplanes (rows of normals, points, and tangent spaces), returning them along with
+        # the rate of change of each point. Batched Modelers add a leading sample axis.
+        matrix = self.matrix[..., :3, :3]
+        translation = self.matrix[..., np.newaxis, :3, 3]
+        normals = normals @ np.swapaxes(self.matrix_inverse_transpose(), -1, -2)
+        normals = normals / np.linalg.norm(normals, axis=-1)[..., np.newaxis]
+        tangentSpaces = matrix[..., np.newaxis, :, :] @ tangentSpaces
+        dPoints = points @ np.swapaxes(self.dMatrix[..., :3, :3], -1, -2) + self.dMatrix[..., np.newaxis, :3, 3]
+        points = points @ np.swapaxes(matrix, -1, -2) + translation
+        return normals, points, tangentSpaces, dPoints
+
+    def transform_planar(self, solid):
+        # Transform a 3D PlanarSolid (returning a list of them for a batched Modeler). Domains are shared, not copied.
+        assert solid.dimension == 3
+        normals, points, tangentSpaces, dPoints = self.transform_hyperplanes(solid.normals, solid.points, solid.tangentSpaces)
+        def build(normals, points, tangentSpaces, dPoints):
+            return planar.PlanarSolid(solid.dimension, solid.containsInfinity, normals, points, tangentSpaces, solid.domains, solid.domainIndices, dPoints)
+        if self.count is None:
+            return build(normals, points, tangentSpaces, dPoints)
+        else:
+            return [build(*sample) for sample in zip(normals, points, tangentSpaces, dPoints)]
+
+    def transform_boundaries(self, boundaries):
+        # Transform many boundaries at once (returning a list of them per sample for a batched Modeler).
+        # Bounded 3D hyperplane boundaries are stacked and transformed with a few array operations;
+        # any others go through transform one at a time.
+        if not boundaries or not all(isinstance(boundary.manifold, Hyperplane) and boundary.manifold.range_dimension() == 3 and 
+            boundary.domain.bounds is not None for boundary in boundaries):
+            if self.count is None:
+                return [self.transform(boundary) for boundary in boundaries]
+            else:
+                return [[self.sample(i).transform(boundary) for boundary in boundaries] for i in range(self.count)]
+
+        normals, points, tangentSpaces, dPoints = self.transform_hyperplanes(np.array([boundary.manifold._normal for boundary in boundaries]),
+            np.array([boundary.manifold._point for boundary in boundaries]), np.array([boundary.manifold._tangentSpace for boundary in boundaries]))
+        # Range bounds computed the same way as Hyperplane.trimmed_range_bounds.
+        corners = tangentSpaces @ np.array([boundary.domain.bounds for boundary in boundaries]) + points[..., np.newaxis]
+        bounds = np.stack((corners.min(axis=-1), corners.max(axis=-1)), axis=-1)
+
+        def build_boundaries(normals, points, tangentSpaces, dPoints, bounds):
+            # The normals are orthogonal to the tangent spaces by construction, so skip the constructor checks.
+            transformedBoundaries = []
+            for boundary, normal, point, tangentSpace, dP, boundaryBounds in zip(boundaries, normals, points, tangentSpaces, dPoints, bounds):
+                hyperplane = utils.trusted_hyperplane(normal, point, tangentSpace)
+                hyperplane._dP = dP
+                transformedBoundary = Boundary.__new__(Boundary)
+                transformedBoundary.manifold = hyperplane
+                transformedBoundary.domain = boundary.domain
+                transformedBoundary.bounds = boundaryBounds
+                transformedBoundaries.append(transformedBoundary)
+            return transformedBoundaries
+
+        if self.count is None:
+            return build_boundaries(normals, points, tangentSpaces, dPoints, bounds)
+        else:
+            return [build_boundaries(*sample) for sample in zip(normals, points, tangentSpaces, dPoints, bounds)]
+
     def translate(self, v, dV=(0.0, 0.0, 0.0)):
         self.multiply(*self.translation(v, dV))
         
     @staticmethod
     def translation(v, dV=(0.0, 0.0, 0.0)):
-        count = min(len(v), 3)
-        matrix = np.identity(4)
-        matrix[:count, 3] = v[:count]
-
-        count = min(len(dV), 3)
-        dMatrix = np.zeros((4, 4))
-        dMatrix[3,3] = 1.0
-        dMatrix[:count, 3] = dV[:count]
+        if any(isinstance(value, dual.Dual) for value in v):
+            v, dV = dual.split(tuple(v))
+        v = Modeler.components(v[:3])
+        dV = Modeler.components(dV[:3])
+        shape = np.broadcast_shapes(v.shape[:-1], dV.shape[:-1])
+        matrix = np.broadcast_to(np.identity(4), shape + (4, 4)).copy()
+        matrix[..., :v.shape[-1], 3] = v
+
+        dMatrix = np.zeros(shape + (4, 4))
+        dMatrix[..., 3, 3] = 1.0
+        dMatrix[..., :dV.shape[-1], 3] = dV
 
         return matrix, dMatrix
@@ -0,0 +1,85 @@
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from bspy import Solid, Hyperplane
+import utils
+import broadphase
+import instrument
+
+def slab_groups(tValues1, tValues2, groupSize=1):
+    # Split the merged time samples of both movers into consecutive groups of groupSize slabs.
+    breakpoints = sorted(set(tValues1) | set(tValues2))
+    assert len(breakpoints) >= 2
+    groups = []
+    for i in range(0, len(breakpoints) - 1, groupSize):
+        groups.append(breakpoints[i:i + groupSize + 1])
+    return groups
+
+def restrict_time_values(tValues, start, end):
+    return [start] + [t for t in tValues if start < t < end] + [end]
+
+def sample_at(solidFunction, tValues, t):
+    # The mover's sample at t as its own extrusion over tValues has it: between its samples, the previous sample
+    # advanced along its rates (see utils.advance_sample). Slabs split at the other mover's breakpoints sample
+    # with functools.partial(sample_at, solidFunction, tValues), so they match the mover's own extrusion.
+    if t in tValues:
+        return solidFunction(t)
+    previous = [tValue for tValue in tValues if tValue < t]
+    if not previous:
+        return solidFunction(t)
+    return utils.advance_sample(solidFunction(previous[-1]), t - previous[-1])
+
+@instrument.traced("intersect_slabs")
+def intersect_slabs(solidFunction1, tValues1, solidFunction2, tValues2, merge=True, cache=None):
+    # Extrude both movers over the time range of a group and intersect them.
+    extruded1 = utils.extrude_time(solidFunction1, tValues1, merge=merge)
+    extruded2 = utils.extrude_time(solidFunction2, tValues2, merge=merge)
+    return broadphase.intersection(extruded1, extruded2, cache)
+
+def is_time_cap(manifold, tValues, tolerance=1.0e-9):
+    # Time caps are the only extruded boundaries with a normal along the time axis.
+    if not isinstance(manifold, Hyperplane) or abs(abs(manifold._normal[-1]) - 1.0) > tolerance:
+        return False
+    t = manifold._point[-1]
+    return any(abs(t - tValue) < tolerance for tValue in tValues)
+
+def stitch_slabs(solids, tValues):
+    # Combine per-group space-time solids into one, dropping the coincident caps at the internal tValues.
+    assert solids
+    stitched = Solid(solids[0].dimension, False)
+    for solid in solids:
+        for boundary in solid.boundaries:
+            if not is_time_cap(boundary.manifold, tValues):
+                stitched.add_boundary(boundary)
+    return stitched
+
+@instrument.traced("extrude_slabs")
+def extrude_slabs(solidFunction, tValues, groups, merge=True):
+    # The extrusion of one mover over each group of slabs, sampling it only at its own tValues (see sample_at).
+    samples = {}
+    def sampledFunction(t):
+        if t not in samples:
+            samples[t] = solidFunction(t)
+        return samples[t]
+    function = functools.partial(sample_at, sampledFunction, tuple(tValues))
+    return [utils.extrude_time(function, restrict_time_values(tValues, group[0], group[-1]), merge=merge) for group in groups]
+
+@instrument.traced("intersect_slab_extrusions")
+def intersect_slab_extrusions(slabs1, slabs2, groups, maxWorkers=None):
+    # Intersect the extrusions of two movers over the same groups (see extrude_slabs) in a process pool, then
+    # stitch the results.
+    if maxWorkers == 1 or len(groups) == 1:
+        solids = list(map(broadphase.intersection, slabs1, slabs2))
+    else:
+        with ProcessPoolExecutor(maxWorkers) as executor:
+            solids = list(executor.map(broadphase.intersection, slabs1, slabs2))
+    return stitch_slabs(solids, [group[0] for group in groups[1:]])
+
+@instrument.traced("intersect_extrusions")
+def intersect_extrusions(solidFunction1, tValues1, solidFunction2, tValues2, groupSize=1, maxWorkers=None, merge=True):
+    # Intersect the time extrusions of two movers group by group in a process pool, then stitch the results.
+    # Each mover is only sampled at its own tValues, so the result matches the intersection of the movers' whole
+    # extrusions.
+    groups = slab_groups(tValues1, tValues2, groupSize)
+    slabs1 = extrude_slabs(solidFunction1, tValues1, groups, merge)
+    slabs2 = extrude_slabs(solidFunction2, tValues2, groups, merge)
+    return intersect_slab_extrusions(slabs1, slabs2, groups, maxWorkers)
@@ -0,0 +1,44 @@
+from functools import lru_cache
+from bspy import Hyperplane
+import utils
+
+# Part library: each prototype is built once per set of defining parameters and shared between callers.
+# Prototypes are frozen (their arrays are read-only), so transform them (Modeler.transform) rather than edit them.
+# Parameters must be hashable, such as tuples of tuples.
+
+def freeze(solid):
+    for boundary in solid.boundaries:
+        manifold = boundary.manifold
+        if isinstance(manifold, Hyperplane):
+            manifold._normal.flags.writeable = False
+            manifold._point.flags.writeable = False
+            manifold._tangentSpace.flags.writeable = False
+        if boundary.bounds is not None:
+            boundary.bounds.flags.writeable = False
+        freeze(boundary.domain)
+    if solid.bounds is not None:
+        solid.bounds.flags.writeable = False
+    return solid
+
+@lru_cache(maxsize=256)
+def hypercube(bounds):
+    return freeze(Hyperplane.create_hypercube(bounds))
+
+@lru_cache(maxsize=64)
+def faceted_prism(points, path):
+    # A straight extrusion along z is built along with the polygon; any other path goes through extrude_path.
+    if len(path) == 2 and path[0][:2] == path[1][:2]:
+        return freeze(utils.create_faceted_solid_from_points(points, (path[0][2], path[1][2])))
+    return freeze(utils.extrude_path(utils.create_faceted_solid_from_points(points), path))
+
+@lru_cache(maxsize=64)
+def hollow_prism(outerBounds, innerBounds, path):
+    return freeze(utils.extrude_path(hypercube(outerBounds) - hypercube(innerBounds), path))
+
+def cache_info():
+    return {"hypercube" : hypercube.cache_info(), "faceted_prism" : faceted_prism.cache_info(), "hollow_prism" : hollow_prism.cache_info()}
+
+def cache_clear():
+    hypercube.cache_clear()
+    faceted_prism.cache_clear()
+    hollow_prism.cache_clear()
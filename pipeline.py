@@ -0,0 +1,271 @@
+import argparse
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import types
+from importlib import metadata
+import numpy as np
+import utils
+import broadphase
+import parallel
+import collision
+import storage
+import instrument
+import intersections
+
+# Headless extrude/intersect pipeline whose stages are cached on disk by a hash of their inputs.
+#
+# A stage's key covers the source of the solid function and of every function it reaches (so the parameter
+# functions and the part geometry in create_robot), the contents of the project modules it uses, the tValues,
+# the tolerance, and the numpy/bspy versions. Changing robot2's motion changes only robot2's key, so robot1's
+# extrusion still loads from the cache. Stage results are stored as storage containers named by their key;
+# the least recently used are evicted once the cache grows past its size limit.
+
+directory = os.path.dirname(os.path.abspath(__file__))
+
+def is_local(module):
+    fileName = getattr(module, "__file__", None)
+    return fileName is not None and os.path.dirname(os.path.abspath(fileName)) == directory
+
+def code_names(code):
+    # Global names referenced by code and the functions, lambdas, and comprehensions nested in it.
+    names = list(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names.extend(code_names(constant))
+    return names
+
+def fingerprint(value, seen=None):
+    # A stable description of value for hashing: the source of local functions (recursively through the globals
+    # and closure cells they reference), the functions and arguments of partials and bound methods, the contents of
+    # local modules, the class and attributes of local class instances, and the repr of plain data. Other callables
+    # can't be described stably, so they raise ValueError.
+    seen = set() if seen is None else seen
+    if isinstance(value, types.ModuleType):
+        if is_local(value):
+            with open(value.__file__, "rb") as file:
+                return hashlib.sha256(file.read()).hexdigest()
+        return value.__name__
+    if callable(value) and hasattr(value, "__wrapped__"):
+        # Decorated functions, such as lru_cache wrappers, are described by the function they wrap.
+        value = inspect.unwrap(value)
+    if isinstance(value, functools.partial):
+        return {"partial" : fingerprint(value.func, seen), "args" : fingerprint(value.args, seen), "keywords" : fingerprint(value.keywords, seen)}
+    if isinstance(value, types.MethodType):
+        return {"method" : fingerprint(value.__func__, seen), "self" : fingerprint(value.__self__, seen)}
+    if isinstance(value, types.FunctionType):
+        module = inspect.getmodule(value)
+        if module is None or not is_local(module):
+            return f"{value.__module__}.{value.__qualname__}"
+        if id(value) in seen:
+            return value.__qualname__
+        seen.add(id(value))
+        references = {}
+        for name in sorted(set(code_names(value.__code__))):
+            if name in value.__globals__:
+                reference = value.__globals__[name]
+                # Mutable globals, such as caches, are described by the source that defines them, not their state.
+                references[name] = fingerprint(module if isinstance(reference, (dict, list, set)) else reference, seen)
+        closure = {}
+        for name, cell in zip(value.__code__.co_freevars, value.__closure__ or ()):
+            try:
+                closure[name] = fingerprint(cell.cell_contents, seen)
+            except ValueError:
+                # An empty cell (a name the enclosing function hasn't assigned yet).
+                closure[name] = None
+        return {"source" : inspect.getsource(value), "defaults" : repr(value.__defaults__), "references" : references, "closure" : closure}
+    if isinstance(value, (types.BuiltinFunctionType, np.ufunc)):
+        return f"{getattr(value, '__module__', None) or 'numpy'}.{value.__name__}"
+    if isinstance(value, type):
+        module = inspect.getmodule(value)
+        return fingerprint(module, seen) if module is not None and is_local(module) else f"{value.__module__}.{value.__qualname__}"
+    if is_local(inspect.getmodule(type(value))) and hasattr(value, "__dict__"):
+        if id(value) in seen:
+            return type(value).__qualname__
+        seen.add(id(value))
+        return {"class" : fingerprint(type(value), seen), "attributes" : fingerprint(vars(value), seen)}
+    if callable(value):
+        raise ValueError(f"Can't fingerprint {value!r}: use a function, a functools.partial of one, or a bound method")
+    if isinstance(value, np.ndarray):
+        return {"dtype" : value.dtype.str, "shape" : value.shape, "data" : hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()}
+    if isinstance(value, (list, tuple)):
+        return [fingerprint(item, seen) for item in value]
+    if isinstance(value, dict):
+        return {str(key) : fingerprint(item, seen) for key, item in sorted(value.items(), key=lambda item: repr(item[0]))}
+    return repr(value)
+
+def environment():
+    return {"numpy" : np.__version__, "bspy" : metadata.version("bspy")}
+
+class StageCache:
+    def __init__(self, path=None, maxBytes=2**32):
+        self.path = path or os.path.join(os.path.expanduser("~"), ".cache", "modeler")
+        self.maxBytes = maxBytes
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, stage, **inputs):
+        description = {"stage" : stage, "environment" : environment(), "inputs" : {name : fingerprint(value) for name, value in inputs.items()}}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def file_name(self, key):
+        return os.path.join(self.path, key + ".solid")
+
+    def load(self, key, tRange=None):
+        fileName = self.file_name(key)
+        if not os.path.exists(fileName):
+            return None
+        # Loading counts as a use for eviction.
+        os.utime(fileName)
+        return storage.load(fileName, tRange)
+
+    def save(self, key, solids):
+        fileName = self.file_name(key)
+        # Write to a temporary file first, so an interrupted save never leaves a truncated entry behind.
+        temporaryName = f"{fileName}.{os.getpid()}.tmp"
+        storage.save(temporaryName, *solids)
+        os.replace(temporaryName, fileName)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith(".solid"):
+                status = os.stat(os.path.join(self.path, name))
+                entries.append((status.st_mtime, status.st_size, name))
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+        # Keep the newest entry, even if it alone is larger than maxBytes.
+        for mtime, entrySize, name in entries[:-1]:
+            if size <= self.maxBytes:
+                break
+            logging.info(f"Evict {name} from stage cache")
+            os.remove(os.path.join(self.path, name))
+            size -= entrySize
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith(".solid"):
+                os.remove(os.path.join(self.path, name))
+
+    def stage(self, stage, compute, tRange=None, **inputs):
+        # Return the solids compute() produces for inputs, loading them from the cache when they're already there.
+        key = self.key(stage, **inputs)
+        solids = self.load(key, tRange)
+        if solids is not None:
+            logging.info(f"Load {stage} from stage cache ({key[:12]})")
+            return solids
+        logging.info(f"Compute {stage}")
+        solids = compute()
+        self.save(key, solids)
+        if tRange is not None:
+            solids = self.load(key, tRange)
+        return solids
+
+class NoCache:
+    # Stand-in for StageCache that always computes.
+    def stage(self, stage, compute, tRange=None, **inputs):
+        logging.info(f"Compute {stage}")
+        return compute()
+
+def time_values(tValues):
+    # Plain floats, so equal time values hash the same whatever their type.
+    return tuple(float(t) for t in tValues)
+
+def extrude(cache, solidFunction, tValues, tolerance=None, merge=True):
+    [extrusion] = cache.stage("extrude", lambda: [utils.extrude_time(solidFunction, tValues, tolerance, merge=merge)],
+        code=utils.extrude_time, solidFunction=solidFunction, tValues=time_values(tValues), tolerance=tolerance, merge=merge)
+    return extrusion
+
+def extrude_slabs(cache, solidFunction, tValues, groups, merge=True):
+    # The mover's extrusion over each group of slabs (see parallel.extrude_slabs). The groups come from both movers'
+    # tValues, but the mover is only sampled at its own, so a change to the other mover's motion alone reuses these.
+    return cache.stage("extrude_slabs", lambda: parallel.extrude_slabs(solidFunction, tValues, groups, merge),
+        code=(utils.extrude_time, parallel.extrude_slabs), solidFunction=solidFunction, tValues=time_values(tValues),
+        groups=[time_values(group) for group in groups], merge=merge)
+
+def intersect(cache, solidFunction1, tValues1, solidFunction2, tValues2, tolerance=None, maxWorkers=1, tRange=None, refine=None, merge=True):
+    # Intersect the time extrusions of two movers. Serially, the extrusions are cached stages of their own; with
+    # more than one worker, each mover's slab extrusions are a cached stage instead, and the slabs are intersected
+    # in a process pool (see parallel.intersect_slab_extrusions). Both give the intersection of the movers' whole
+    # extrusions. Adaptive sampling (tolerance) always runs serially. With refine, collision.refined_intersection
+    # checks groups of refine slabs coarsely first and only extrudes the colliding ones slab by slab. Unless merge
+    # is off, the coplanar boundaries of each sample are merged before extrusion (see utils.extrude_time). Serial
+    # intersections keep their manifold intersections in intersections.shared.
+    def compute():
+        if refine:
+            return [collision.refined_intersection(solidFunction1, tValues1, solidFunction2, tValues2, refine, merge, intersections.shared)]
+        if maxWorkers == 1 or tolerance is not None:
+            extrusion1 = extrude(cache, solidFunction1, tValues1, tolerance, merge)
+            extrusion2 = extrude(cache, solidFunction2, tValues2, tolerance, merge)
+            return [broadphase.intersection(extrusion1, extrusion2, intersections.shared)]
+        groups = parallel.slab_groups(tValues1, tValues2)
+        slabs1 = extrude_slabs(cache, solidFunction1, tValues1, groups, merge)
+        slabs2 = extrude_slabs(cache, solidFunction2, tValues2, groups, merge)
+        return [parallel.intersect_slab_extrusions(slabs1, slabs2, groups, maxWorkers)]
+    [intersection] = cache.stage("intersect", compute, tRange,
+        code=(utils.extrude_time, broadphase.intersection, collision.refined_intersection), solidFunction1=solidFunction1, tValues1=time_values(tValues1),
+        solidFunction2=solidFunction2, tValues2=time_values(tValues2), tolerance=tolerance, refine=refine, merge=merge)
+    return intersection
+
+def argument_parser(description, output):
+    # Command line shared by the scenario scripts: python robots.py build --output robots.solid
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("option", choices=("build", "test", "draw", "check"), nargs="?", default="draw")
+    parser.add_argument("--output", default=output, help="file the build writes the intersection to, and draw reads it from")
+    parser.add_argument("--cache", help="stage cache directory (default ~/.cache/modeler)")
+    parser.add_argument("--cache-size", type=float, default=4.0, help="stage cache size limit in GB")
+    parser.add_argument("--no-cache", action="store_true", help="recompute every stage")
+    parser.add_argument("--tolerance", type=float, help="adaptive time sampling tolerance for the extrusions")
+    parser.add_argument("--refine", type=int, help="check groups of this many slabs coarsely first, refining only where they collide (4 for check)")
+    parser.add_argument("--no-merge", dest="merge", action="store_false", help="don't merge the coplanar boundaries of each sample before extrusion")
+    parser.add_argument("--workers", type=int, default=0, help="processes for the slab intersections (default 0 for one per core; 1 runs serially)")
+    parser.add_argument("--trace", help="write a Chrome trace of the pipeline stages to this file")
+    parser.add_argument("--frames", help="write the draw frames to this directory instead of showing them")
+    return parser
+
+def open_cache(args):
+    if args.no_cache:
+        return NoCache()
+    return StageCache(args.cache, int(args.cache_size * 2**30))
+
+def build(args, solidFunction1, tValues1, solidFunction2, tValues2):
+    cache = open_cache(args)
+    if args.trace:
+        with instrument.recording(args.trace):
+            intersection = intersect(cache, solidFunction1, tValues1, solidFunction2, tValues2, args.tolerance, args.workers or None, refine=args.refine, merge=args.merge)
+    else:
+        intersection = intersect(cache, solidFunction1, tValues1, solidFunction2, tValues2, args.tolerance, args.workers or None, refine=args.refine, merge=args.merge)
+    logging.info(f"Manifold intersection cache: {intersections.shared.info()}")
+    logging.info(f"Save intersection to {args.output}")
+    storage.save(args.output, intersection)
+    return intersection
+
+def check(args, solidFunction1, tValues1, solidFunction2, tValues2, samples=1000, seed=0):
+    # Check that collision.refined_intersection matches parallel.intersect_extrusions: the same bounds and the
+    # same containment at random points of the bounds. Exits with 1 on a mismatch.
+    logging.info("Intersect coarse to fine")
+    refined = collision.refined_intersection(solidFunction1, tValues1, solidFunction2, tValues2, args.refine or 4, args.merge)
+    logging.info("Intersect slab by slab")
+    reference = parallel.intersect_extrusions(solidFunction1, tValues1, solidFunction2, tValues2, maxWorkers=args.workers or None, merge=args.merge)
+    refinedBounds, referenceBounds = utils.solid_bounds(refined), utils.solid_bounds(reference)
+    mismatches = 0
+    if refinedBounds is None or referenceBounds is None:
+        mismatches += refinedBounds is not referenceBounds
+    else:
+        mismatches += not np.allclose(refinedBounds, referenceBounds)
+        points = np.random.default_rng(seed).uniform(referenceBounds[:, 0], referenceBounds[:, 1], (samples, len(referenceBounds)))
+        mismatches += sum(broadphase.contains_point(refined, point) != broadphase.contains_point(reference, point) for point in points)
+    if mismatches:
+        logging.warning(f"Refined intersection differs: {mismatches} mismatches")
+        raise SystemExit(1)
+    logging.info(f"Refined intersection matches ({samples} points)")
+
+def load_intersection(args, solidFunction1, tValues1, solidFunction2, tValues2, tRange=None):
+    # Load the built intersection from args.output, or get it from the stage cache (computing it if need be).
+    if os.path.exists(args.output):
+        [intersection] = storage.load(args.output, tRange)
+        return intersection
+    return intersect(open_cache(args), solidFunction1, tValues1, solidFunction2, tValues2, args.tolerance, args.workers or None, tRange, args.refine, args.merge)
@@ -0,0 +1,265 @@
+from collections import OrderedDict
+import numpy as np
+from bspy import Solid, Boundary, Hyperplane
+import utils
+
+# Compact representation for solids bounded only by hyperplanes. Instead of a Boundary and a Hyperplane (with its
+# own small arrays) per boundary, a PlanarSolid holds one array each of normals, points, and tangent spaces,
+# row i being boundary i. Boundary domains are PlanarSolids too, referenced by index into a list of distinct
+# domains, so a domain shared by many boundaries (every face of a part, in every time sample) is stored once.
+#
+# PlanarSolids are never changed once built, so they share domains freely. Convert with from_solid and
+# to_solid; Modeler.transform, utils.extrude_path, and utils.extrude_time work on them directly.
+
+class PlanarSolid:
+    def __init__(self, dimension, containsInfinity, normals=None, points=None, tangentSpaces=None, domains=(), domainIndices=None, dPoints=None):
+        self.dimension = dimension
+        self.containsInfinity = containsInfinity
+        self.normals = np.zeros((0, dimension)) if normals is None else normals
+        self.points = np.zeros((0, dimension)) if points is None else points
+        self.tangentSpaces = np.zeros((0, dimension, max(dimension - 1, 0))) if tangentSpaces is None else tangentSpaces
+        self.domains = list(domains)
+        self.domainIndices = np.zeros(0, np.int64) if domainIndices is None else domainIndices
+        # Rate of change of each point, for time samples (see Modeler.transform and extrude_time).
+        self.dPoints = dPoints
+
+    def __len__(self):
+        return len(self.normals)
+
+    def __repr__(self):
+        return "PlanarSolid({0}, {1}, {2} boundaries)".format(self.dimension, self.containsInfinity, len(self))
+
+    def boundary_bounds(self):
+        # Range bounds of each boundary, (n, dimension, 2), computed like Boundary does (from two domain corners).
+        # None if any boundary is unbounded.
+        if not hasattr(self, "_boundaryBounds"):
+            if self.dimension <= 1:
+                self._boundaryBounds = np.stack((self.points, self.points), axis=-1)
+            else:
+                domainBounds = [domain.bounds() for domain in self.domains]
+                if any(bounds is None for bounds in domainBounds):
+                    self._boundaryBounds = None
+                else:
+                    domainBounds = np.array(domainBounds).reshape(-1, self.dimension - 1, 2)[self.domainIndices]
+                    corners = self.tangentSpaces @ domainBounds + self.points[:, :, np.newaxis]
+                    self._boundaryBounds = np.stack((corners.min(axis=-1), corners.max(axis=-1)), axis=-1)
+        return self._boundaryBounds
+
+    def bounds(self):
+        # Bounds of the solid, as Solid.bounds would have them.
+        boundaryBounds = self.boundary_bounds() if len(self) > 0 else None
+        if boundaryBounds is None:
+            return None
+        return np.stack((boundaryBounds[:, :, 0].min(axis=0), boundaryBounds[:, :, 1].max(axis=0)), axis=-1)
+
+    @staticmethod
+    def from_solid(solid):
+        # Convert a hyperplane-bounded bspy Solid. Domains are shared by geometry: equal domains convert to one
+        # PlanarSolid, and each converted domain is kept for later conversions (see domainCacheSize).
+        if isinstance(solid, PlanarSolid):
+            return solid
+        dimension = solid.dimension
+        count = len(solid.boundaries)
+        if not all(isinstance(boundary.manifold, Hyperplane) for boundary in solid.boundaries):
+            raise ValueError("Only hyperplane-bounded solids can be converted")
+        normals = np.array([boundary.manifold._normal for boundary in solid.boundaries], float).reshape(count, dimension)
+        points = np.array([boundary.manifold._point for boundary in solid.boundaries], float).reshape(count, dimension)
+        if dimension > 1:
+            tangentSpaces = np.array([boundary.manifold._tangentSpace for boundary in solid.boundaries], float).reshape(count, dimension, dimension - 1)
+        else:
+            tangentSpaces = np.zeros((count, 1, 0))
+        domains = []
+        slots = {}
+        domainIndices = np.empty(count, np.int64)
+        for i, boundary in enumerate(solid.boundaries):
+            domain = from_domain(boundary.domain)
+            if id(domain) not in slots:
+                slots[id(domain)] = len(domains)
+                domains.append(domain)
+            domainIndices[i] = slots[id(domain)]
+        dPoints = None
+        if count > 0 and all(hasattr(boundary.manifold, "_dP") for boundary in solid.boundaries):
+            dPoints = np.array([boundary.manifold._dP for boundary in solid.boundaries], float).reshape(count, dimension)
+        return PlanarSolid(dimension, solid.containsInfinity, normals, points, tangentSpaces, domains, domainIndices, dPoints)
+
+    def to_solid(self):
+        # Convert to a bspy Solid. Shared domains convert to shared Solids; the conversion is kept on the PlanarSolid.
+        if not hasattr(self, "_solid"):
+            solid = Solid(self.dimension, self.containsInfinity)
+            domains = [domain.to_solid() for domain in self.domains]
+            boundaryBounds = self.boundary_bounds()
+            for i in range(len(self)):
+                tangentSpace = self.tangentSpaces[i] if self.dimension > 1 else 0.0
+                hyperplane = utils.trusted_hyperplane(self.normals[i], self.points[i], tangentSpace)
+                if self.dPoints is not None:
+                    hyperplane._dP = self.dPoints[i]
+                domain = domains[self.domainIndices[i]]
+                if boundaryBounds is None:
+                    solid.add_boundary(Boundary(hyperplane, domain))
+                else:
+                    solid.add_boundary(utils.trusted_boundary(hyperplane, domain, boundaryBounds[i]))
+            self._solid = solid
+        return self._solid
+
+# Converted domains by geometric signature (utils.domain_signature), least recently used first.
+domainCacheSize = 4096
+convertedDomains = OrderedDict()
+
+def domain_cache_clear():
+    convertedDomains.clear()
+
+def from_domain(domain):
+    signature = utils.domain_signature(domain)
+    if signature is None:
+        raise ValueError("Only hyperplane-bounded solids can be converted")
+    if signature in convertedDomains:
+        convertedDomains.move_to_end(signature)
+        return convertedDomains[signature]
+    converted = PlanarSolid.from_solid(domain)
+    convertedDomains[signature] = converted
+    if len(convertedDomains) > domainCacheSize:
+        convertedDomains.popitem(last=False)
+    return converted
+
+def concatenate(solids):
+    # One PlanarSolid with the boundaries of all of solids, like adding each part's boundaries to one Solid.
+    solids = [PlanarSolid.from_solid(solid) for solid in solids]
+    assert solids
+    domains = []
+    slots = {}
+    domainIndices = []
+    for solid in solids:
+        for domain in solid.domains:
+            if id(domain) not in slots:
+                slots[id(domain)] = len(domains)
+                domains.append(domain)
+        domainIndices.append(np.array([slots[id(domain)] for domain in solid.domains], np.int64)[solid.domainIndices] if len(solid) else np.zeros(0, np.int64))
+    dPoints = None
+    if all(solid.dPoints is not None for solid in solids):
+        dPoints = np.concatenate([solid.dPoints for solid in solids])
+    return PlanarSolid(solids[0].dimension, solids[0].containsInfinity, np.concatenate([solid.normals for solid in solids]),
+        np.concatenate([solid.points for solid in solids]), np.concatenate([solid.tangentSpaces for solid in solids]),
+        domains, np.concatenate(domainIndices), dPoints)
+
+def axis_aligned(dimension, point, flipNormal):
+    # Arrays of Hyperplane.create_axis_aligned(dimension, dimension - 1, 0.0, flipNormal).translate(point).
+    diagonal = np.identity(dimension)
+    normal = (-1.0 if flipNormal else 1.0) * diagonal[-1]
+    return normal, np.array(point, float), diagonal[:, :-1]
+
+def create_interval(lower, upper):
+    # The number-line solid [lower, upper], as utils.create_interval builds it.
+    point = PlanarSolid(0, True)
+    return PlanarSolid(1, False, np.array(((-1.0,), (1.0,))), np.array(((lower,), (upper,))), np.zeros((2, 1, 0)), [point], np.zeros(2, np.int64))
+
+# Extruded domains by domain and extent, least recently used first (entries keep their domain alive, so ids stay unique).
+extrusionCacheSize = 4096
+domainExtrusions = OrderedDict()
+
+def extrude_domain(domain, extent):
+    # extrude_path(domain, ((0, ..., 0), (0, ..., extent))), memoized.
+    key = (id(domain), float(extent))
+    if key in domainExtrusions:
+        domainExtrusions.move_to_end(key)
+        return domainExtrusions[key][1]
+    if domain.dimension == 0:
+        extrudedDomain = create_interval(0.0, extent)
+    else:
+        domainPath = np.zeros((2, domain.dimension + 1))
+        domainPath[1, domain.dimension] = extent
+        extrudedDomain = extrude_path(domain, domainPath)
+    domainExtrusions[key] = (domain, extrudedDomain)
+    if len(domainExtrusions) > extrusionCacheSize:
+        domainExtrusions.popitem(last=False)
+    return extrudedDomain
+
+def extruded_domains(solid, extent, domains, slots):
+    # Indices (into domains, which is extended as needed) of the extrusions of solid's domains by extent.
+    indices = []
+    for domain in solid.domains:
+        extrudedDomain = extrude_domain(domain, extent)
+        if id(extrudedDomain) not in slots:
+            slots[id(extrudedDomain)] = len(domains)
+            domains.append(extrudedDomain)
+        indices.append(slots[id(extrudedDomain)])
+    return np.array(indices, np.int64)[solid.domainIndices] if len(solid) else np.zeros(0, np.int64)
+
+def stack(dimension, containsInfinity, blocks, domains):
+    # PlanarSolid from a list of (normals, points, tangentSpaces, domainIndices) blocks.
+    return PlanarSolid(dimension, containsInfinity, np.concatenate([block[0] for block in blocks]), np.concatenate([block[1] for block in blocks]),
+        np.concatenate([block[2] for block in blocks]), domains, np.concatenate([block[3] for block in blocks]))
+
+def cap_block(dimension, point, flipNormal, domainIndex):
+    normal, point, tangentSpace = axis_aligned(dimension, point, flipNormal)
+    return normal[np.newaxis], point[np.newaxis], tangentSpace[np.newaxis], np.array((domainIndex,), np.int64)
+
+def extrude_path(solid, path):
+    # utils.extrude_path for a PlanarSolid: each segment extrudes every boundary in a few array operations.
+    assert len(path) > 1
+    assert solid.dimension+1 == len(path[0])
+    dimension = solid.dimension
+    count = len(solid)
+    domains = []
+    slots = {}
+    blocks = []
+    point = np.atleast_1d(np.array(path[0], float))
+    for nextPoint in path[1:]:
+        nextPoint = np.atleast_1d(np.array(nextPoint, float))
+        tangent = nextPoint - point
+        extent = tangent[dimension]
+        tangent = tangent / extent
+        # Normals orthogonal to both the boundary tangent spaces and the path tangent.
+        normals = np.zeros((count, dimension + 1))
+        normals[:, :dimension] = solid.normals
+        normals[:, dimension] = -solid.normals @ tangent[:dimension]
+        normals = normals / np.linalg.norm(normals, axis=1)[:, np.newaxis]
+        points = np.zeros((count, dimension + 1))
+        points[:, :dimension] = solid.points
+        points += point
+        tangentSpaces = np.zeros((count, dimension + 1, dimension))
+        if dimension > 1:
+            tangentSpaces[:, :dimension, :dimension-1] = solid.tangentSpaces
+        tangentSpaces[:, :, dimension-1] = tangent
+        blocks.append((normals, points, tangentSpaces, extruded_domains(solid, extent, domains, slots)))
+        point = nextPoint
+
+    # End caps have the solid itself as their domain.
+    domains.append(solid)
+    blocks.append(cap_block(dimension + 1, path[0], True, len(domains) - 1))
+    blocks.append(cap_block(dimension + 1, path[-1], False, len(domains) - 1))
+    return stack(dimension + 1, False, blocks, domains)
+
+def extrude_time(solidFunction, tValues):
+    # utils.extrude_time (without adaptive sampling or merging) for solid functions that return PlanarSolids
+    # with dPoints: each slab extrudes every boundary of its sample in a few array operations.
+    assert(len(tValues) >= 2)
+    t = tValues[0]
+    solid = solidFunction(t)
+    dimension = solid.dimension
+    domains = [solid]
+    slots = {}
+    blocks = [cap_block(dimension + 1, np.append(np.zeros(dimension), t), True, 0)]
+    containsInfinity = solid.containsInfinity
+
+    for tNext in tValues[1:]:
+        # Every sample but the last is extruded along its rates.
+        assert solid.dPoints is not None
+        count = len(solid)
+        normals = np.zeros((count, dimension + 1))
+        normals[:, :dimension] = solid.normals
+        normals[:, dimension] = -np.sum(solid.normals * solid.dPoints, axis=1)
+        normals = normals / np.linalg.norm(normals, axis=1)[:, np.newaxis]
+        points = np.zeros((count, dimension + 1))
+        points[:, :dimension] = solid.points
+        points[:, dimension] = t
+        tangentSpaces = np.zeros((count, dimension + 1, dimension))
+        tangentSpaces[:, :dimension, :dimension-1] = solid.tangentSpaces
+        tangentSpaces[:, :dimension, dimension-1] = solid.dPoints
+        tangentSpaces[:, dimension, dimension-1] = 1.0
+        blocks.append((normals, points, tangentSpaces, extruded_domains(solid, tNext - t, domains, slots)))
+        t = tNext
+        solid = solidFunction(t)
+
+    domains.append(solid)
+    blocks.append(cap_block(dimension + 1, np.append(np.zeros(dimension), t), False, len(domains) - 1))
+    return stack(dimension + 1, containsInfinity, blocks, domains)
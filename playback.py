@@ -0,0 +1,153 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+from bspy import Solid, Boundary, Manifold, Hyperplane
+import broadphase
+import instrument
+import planar
+import storage
+import utils
+
+class TimeIndex:
+    # Index of a space-time solid's boundaries by their extent along the time (last) axis.
+    def __init__(self, solid):
+        self.solid = solid.to_solid() if isinstance(solid, planar.PlanarSolid) else solid
+        self.index = broadphase.BoundsIndex.from_solid(self.solid)
+        self.planar = all(isinstance(boundary.manifold, Hyperplane) for boundary in self.solid.boundaries)
+        self.tEnd = np.max(self.index.boxes[:, -1, 1]) if len(self.index) > 0 else np.inf
+
+    def active_indices(self, t):
+        box = np.full((self.solid.dimension, 2), (-np.inf, np.inf))
+        box[-1] = (t, t)
+        return self.index.query(box)
+
+    def active_boundaries(self, t):
+        return [self.solid.boundaries[i] for i in self.active_indices(t)]
+
+    @instrument.traced("TimeIndex.slice")
+    def slice(self, t):
+        return self.cross_section(t) if self.planar else self.generic_slice(t)
+
+    def cross_section(self, t):
+        # Slice of a hyperplane-bounded solid at t, boundary by boundary: each boundary active at t crosses the
+        # time hyperplane in a hyperplane of its own, over the slice of its domain. Boundaries that end at t
+        # (before the solid's last time) are left to the ones starting there, so slab seams aren't doubled.
+        # The result is the same as generic_slice.
+        crossSection = Solid(self.solid.dimension - 1, self.solid.containsInfinity)
+        for i in self.active_indices(t):
+            tStart, tEnd = self.index.boxes[i, -1]
+            if t < tStart - Manifold.minSeparation or tEnd - Manifold.minSeparation < t < self.tEnd - Manifold.minSeparation:
+                continue
+            boundary = time_cross_section(self.solid.boundaries[i], t)
+            if boundary is not None:
+                crossSection.add_boundary(boundary)
+        return crossSection
+
+    def generic_slice(self, t):
+        # Only boundaries whose time extent contains t can cross the time hyperplane at t, so slicing just those
+        # gives the same slice as slicing the whole solid.
+        active = Solid(self.solid.dimension, self.solid.containsInfinity)
+        for boundary in self.active_boundaries(t):
+            active.add_boundary(boundary)
+        hyperplane = Hyperplane.create_axis_aligned(self.solid.dimension, self.solid.dimension - 1, t)
+        return active.slice(hyperplane)
+
+def is_time_prism(domain):
+    # True for domains extrude_path made along their last axis (as extrude_time does): the end caps, last,
+    # have the cross-section as their domain, and every other boundary runs parallel to the axis.
+    if domain.dimension < 2 or len(domain.boundaries) < 3 or not all(isinstance(boundary.manifold, Hyperplane) for boundary in domain.boundaries):
+        return False
+    start, end = domain.boundaries[-2].manifold, domain.boundaries[-1].manifold
+    axis = np.zeros(domain.dimension)
+    axis[-1] = 1.0
+    return np.allclose(start._normal, -axis) and np.allclose(end._normal, axis) and np.allclose(start._point, 0.0) and \
+        np.allclose(end._point[:-1], 0.0) and domain.boundaries[-2].domain is domain.boundaries[-1].domain and \
+        all(boundary.manifold._normal[-1] == 0.0 for boundary in domain.boundaries[:-2])
+
+def time_cross_section(boundary, t):
+    # Where a space-time hyperplane boundary crosses the time hyperplane at t, as a boundary one dimension lower
+    # (in the time hyperplane's domain coordinates), or None if it doesn't.
+    manifold = boundary.manifold
+    normal = manifold._normal[:-1]
+    length = np.linalg.norm(normal)
+    timeRow = manifold._tangentSpace[-1]
+    if length < Manifold.minSeparation or not np.any(timeRow):
+        # Parallel to the time hyperplane (a time cap).
+        return None
+    offset = t - manifold._point[-1]
+    if np.all(timeRow[:-1] == 0.0) and boundary.domain.dimension >= 2 and is_time_prism(boundary.domain):
+        # Closed form: a prism's cross-section at any time within it is the domain of its caps.
+        step = offset / timeRow[-1]
+        point = manifold._point[:-1] + manifold._tangentSpace[:-1, -1] * step
+        tangentSpace = manifold._tangentSpace[:-1, :-1]
+        domain = boundary.domain.boundaries[-1].domain
+    else:
+        # Slice the domain where the boundary reaches time t.
+        domainPoint = timeRow * offset / np.dot(timeRow, timeRow)
+        domainTangentSpace = np.linalg.svd(timeRow[np.newaxis])[2][1:].T
+        domain = boundary.domain.slice(Hyperplane(timeRow / np.linalg.norm(timeRow), domainPoint, domainTangentSpace))
+        if not domain:
+            return None
+        point = manifold._point[:-1] + manifold._tangentSpace[:-1] @ domainPoint
+        tangentSpace = manifold._tangentSpace[:-1] @ domainTangentSpace
+    return Boundary(utils.trusted_hyperplane(normal / length, point, tangentSpace), domain)
+
+def slice_at_time(extrusion, t):
+    # Slice of a space-time solid (or PlanarSolid, or TimeIndex) at time t. Hyperplane-bounded solids, like those extrude_time
+    # makes, are sliced boundary by boundary in closed form; other solids fall back to Solid.slice.
+    timeIndex = extrusion if isinstance(extrusion, TimeIndex) else TimeIndex(extrusion)
+    return timeIndex.slice(t)
+
+def stream_in_order(executor, function, tValues, prefetch):
+    # Yield (t, function(t)) for each t in tValues, in order, keeping up to prefetch calls ahead of the consumer.
+    pending = deque()
+    try:
+        for t in tValues:
+            pending.append((t, executor.submit(function, t)))
+            if len(pending) > prefetch:
+                t, future = pending.popleft()
+                yield t, future.result()
+        while pending:
+            t, future = pending.popleft()
+            yield t, future.result()
+    finally:
+        # Don't compute results the consumer will never ask for.
+        for t, future in pending:
+            future.cancel()
+
+def iter_time_slices(solid, tValues, prefetch=0, maxWorkers=None):
+    # Lazily yield (t, slice) for each t in tValues, in order.
+    # With prefetch > 0, worker threads compute up to prefetch slices ahead of the consumer.
+    timeIndex = solid if isinstance(solid, TimeIndex) else TimeIndex(solid)
+    if prefetch <= 0:
+        for t in tValues:
+            yield t, timeIndex.slice(t)
+        return
+
+    with ThreadPoolExecutor(maxWorkers or prefetch) as executor:
+        yield from stream_in_order(executor, timeIndex.slice, tValues, prefetch)
+
+def iter_frames(frameFunction, tValues, maxWorkers=None, prefetch=None):
+    # Lazily yield (t, frameFunction(t)) for each t in tValues, in order, building the frames in a process pool.
+    # Each frame is yielded as soon as it and the frames before it are done, with up to prefetch frames (by default
+    # two per worker) in flight. frameFunction must be picklable (a module-level function). With maxWorkers == 1,
+    # the frames are built in this process instead.
+    if maxWorkers == 1:
+        for t in tValues:
+            yield t, frameFunction(t)
+        return
+
+    with ProcessPoolExecutor(maxWorkers) as executor:
+        yield from stream_in_order(executor, frameFunction, tValues, prefetch or 2 * (maxWorkers or os.cpu_count() or 1))
+
+def write_frames(frames, pattern):
+    # Headless playback: save each (t, solid) frame as it arrives to pattern.format(index=index, t=t), a storage
+    # container, and return the file names.
+    fileNames = []
+    for index, (t, solid) in enumerate(frames):
+        fileName = pattern.format(index=index, t=t)
+        os.makedirs(os.path.dirname(fileName) or ".", exist_ok=True)
+        storage.save(fileName, solid)
+        fileNames.append(fileName)
+    return fileNames
@@ -1,8 +1,12 @@
 import logging
+import os
+from functools import lru_cache
 import numpy as np
-from bspy import Solid, Boundary, Hyperplane, Viewer
-from modeler import Modeler
-import utils
+from bspy import Viewer
+import parts
+import pipeline
+import playback
+import scene
 
 # This example involves two robots with long arms that rotate around multiple joints.
 # The length of the arms increases the number of time samples necessary to linearly interpolate the motion.
@@ -11,70 +15,54 @@ import utils
 
 # For a less compute intensive example, see assembly_line.py instead.
 
+@lru_cache(maxsize=16)
+def robot_graph(function):
+    # Built once per parameter function (and once for all constant parameters), so each robot keeps its own cached
+    # part transforms.
+    graph = scene.SceneGraph(("position", "hips", "shoulder", "elbow", "wrist", "bite"))
+    base = parts.hypercube(((-2.0, 2.0),)*3)
+    pivot = parts.hypercube(((-1.0, 1.0),)*3)
+    arm = parts.hypercube(((0.0, 1.0), (-1.0, 1.0), (-1.0, 5.0)))
+    jaw = parts.hypercube(((-0.5, 0.5), (-1.5, 1.5), (0., 0.5)))
+    tooth = parts.hypercube(((-0.5, 0.5), (-0.2, 0.2), (0.0, 1.5)))
+
+    graph.rotate(0, -np.pi / 2)
+    graph.translate("position")
+    graph.add(base)
+    graph.translate((0.0, 0.0, 3.0))
+    graph.rotate(2, "hips")
+    graph.add(pivot)
+    graph.translate((1.0, 0.0, 1.0))
+    graph.rotate(0, "shoulder")
+    graph.add(arm)
+    graph.translate((-0.5, 0.0, 4.0))
+    graph.rotate(0, "elbow")
+    graph.push()
+    graph.scale((0.5, 1.0, 1.0))
+    graph.add(pivot)
+    graph.pop()
+    graph.translate((-1.5, 0.0, 0.0))
+    graph.add(arm)
+    graph.translate((0.5, 0.0, 5.5))
+    graph.rotate(2, "wrist")
+    graph.push()
+    graph.scale((0.5, 0.5, 0.5))
+    graph.add(pivot)
+    graph.pop()
+    graph.translate((0.0, 0.0, 0.5))
+    graph.add(jaw)
+    graph.push()
+    graph.translate((0.0, "bite", 0.5))
+    graph.add(tooth)
+    graph.pop()
+    graph.translate(lambda joints: (0.0, -joints["bite"], 0.5))
+    graph.add(tooth)
+    return graph
+
 def create_robot(parameters, t, robot = None):
-    if robot is None:
-        robot = Solid(3, False)
-    
-    h = 0.0001
-    if callable(parameters):
-        position, hips, shoulder, elbow, wrist, bite = parameters(t)
-        dPosition, dHips, dShoulder, dElbow, dWrist, dBite = parameters(t + h)
-    else:
-        position, hips, shoulder, elbow, wrist, bite = parameters
-        dPosition, dHips, dShoulder, dElbow, dWrist, dBite = parameters
-
-    dPosition = (np.array(dPosition) - np.array(position)) / h
-    dHips = (dHips - hips) / h
-    dShoulder = (dShoulder - shoulder) / h
-    dElbow = (dElbow - elbow) / h
-    dWrist = (dWrist - wrist) / h
-    dBite = (dBite - bite) / h
-
-    modeler = Modeler()
-    base = Hyperplane.create_hypercube(((-2.0, 2.0),)*3)
-    pivot = Hyperplane.create_hypercube(((-1.0, 1.0),)*3)
-    arm = Hyperplane.create_hypercube(((0.0, 1.0), (-1.0, 1.0), (-1.0, 5.0)))
-    jaw = Hyperplane.create_hypercube(((-0.5, 0.5), (-1.5, 1.5), (0., 0.5)))
-    tooth = Hyperplane.create_hypercube(((-0.5, 0.5), (-0.2, 0.2), (0.0, 1.5)))
-
-    def add_boundaries(solid):
-        sld = modeler.transform(solid)
-        for boundary in sld.boundaries:
-            robot.add_boundary(boundary)
-
-    modeler.rotate(0, -np.pi / 2)
-    modeler.translate(position, dPosition)
-    add_boundaries(base)
-    modeler.translate((0.0, 0.0, 3.0))
-    modeler.rotate(2, hips, dHips)
-    add_boundaries(pivot)
-    modeler.translate((1.0, 0.0, 1.0))
-    modeler.rotate(0, shoulder, dShoulder)
-    add_boundaries(arm)
-    modeler.translate((-0.5, 0.0, 4.0))
-    modeler.rotate(0, elbow, dElbow)
-    modeler.push()
-    modeler.scale((0.5, 1.0, 1.0))
-    add_boundaries(pivot)
-    modeler.pop()
-    modeler.translate((-1.5, 0.0, 0.0))
-    add_boundaries(arm)
-    modeler.translate((0.5, 0.0, 5.5))
-    modeler.rotate(2, wrist, dWrist)
-    modeler.push()
-    modeler.scale((0.5, 0.5, 0.5))
-    add_boundaries(pivot)
-    modeler.pop()
-    modeler.translate((0.0, 0.0, 0.5))
-    add_boundaries(jaw)
-    modeler.push()
-    modeler.translate((0.0, bite, 0.5), (0.0, dBite, 0.0))
-    add_boundaries(tooth)
-    modeler.pop()
-    modeler.translate((0.0, -bite, 0.5), (0.0, -dBite, 0.0))
-    add_boundaries(tooth)
-
-    return robot
+    # t may be an array of time values, in which case a list of robots is returned, one per t.
+    # parameters are a function of t or a constant tuple of joints.
+    return robot_graph(parameters if callable(parameters) else None).evaluate(parameters, t, robot)
 
 def robot1_parameters(t):
     position = (4.0, 0.0, 0.0)
@@ -82,7 +70,7 @@ def robot1_parameters(t):
     shoulder = (1 - t) * np.pi / -4  + t * np.pi / 4
     elbow = (1 - t) * np.pi / 2 + t * 2 * np.pi / 4
     wrist = (1 - t) * 0 + t * np.pi / 2
-    bite = 1.0 if t < 0.5 else (2 - 2 * t) * 1.0 + (2 * t - 1) * 0.5
+    bite = np.where(t < 0.5, 1.0, (2 - 2 * t) * 1.0 + (2 * t - 1) * 0.5)
     return (position, hips, shoulder, elbow, wrist, bite)
 
 def robot1(t):
@@ -94,67 +82,78 @@ def robot2_parameters(t):
     shoulder = (1 - t) * np.pi / 2  + t * 2 * np.pi / -4
     elbow = (1 - t) * np.pi / -2 + t * 1 * np.pi / -4
     wrist = (1 - t) * 0 + t * np.pi / -2
-    bite = 1.0 if t < 0.5 else (2 - 2 * t) * 1.0 + (2 * t - 1) * 0.5
+    bite = np.where(t < 0.5, 1.0, (2 - 2 * t) * 1.0 + (2 * t - 1) * 0.5)
     return (position, hips, shoulder, elbow, wrist, bite)
 
 def robot2(t):
     return create_robot(robot2_parameters, t)
 
+def robots(t):
+    # Animation frame: both robots at time t.
+    return create_robot(robot2_parameters, t, create_robot(robot1_parameters, t))
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(module)s:%(lineno)d:%(message)s', datefmt='%H:%M:%S')
     np.set_printoptions(suppress=True)
 
-    option = "test"
+    args = pipeline.argument_parser("Intersect two robots with long, rotating arms.", "robots_intersection.solid").parse_args()
+    tValues = (0.6, 0.7, 0.8, 0.9, 1.0)
 
-    if option == "build":
-        logging.info("Extrude robot1")
-        extruded1 = utils.extrude_time(robot1, (0.6, 0.7, 0.8, 0.9, 1.0))
-        logging.info("Extrude robot2")
-        extruded2 = utils.extrude_time(robot2, (0.6, 0.7, 0.8, 0.9, 1.0))
-        logging.info("Intersect robots")
-        intersection = extruded1.intersection(extruded2)
-        logging.info("Save intersection")
-        Solid.save(r"C:\Users\ericb\OneDrive\Desktop\robots_intersection.json", intersection)
+    if args.option == "build":
+        logging.info("Extrude and intersect robots by time slab")
+        pipeline.build(args, robot1, tValues, robot2, tValues)
+
+    elif args.option == "check":
+        pipeline.check(args, robot1, tValues, robot2, tValues)
 
-    elif option == "test":
+    elif args.option == "test":
         viewer = Viewer()
         viewer.set_background_color(np.array((1, 1, 1, 1),np.float32))
+        cache = pipeline.open_cache(args)
         logging.info("Extrude robot1")
-        extruded1 = utils.extrude_time(robot1, (0.6, 0.7, 0.8, 0.9, 1.0))
+        extruded1 = pipeline.extrude(cache, robot1, tValues, args.tolerance, args.merge)
         logging.info("Extrude robot2")
-        extruded2 = utils.extrude_time(robot2, (0.6, 0.7, 0.8, 0.9, 1.0))
+        extruded2 = pipeline.extrude(cache, robot2, tValues, args.tolerance, args.merge)
         logging.info("Slice intersection")
-        hyperplane = Hyperplane.create_axis_aligned(4, 3, 0.0)
+        timeIndex1, timeIndex2 = playback.TimeIndex(extruded1), playback.TimeIndex(extruded2)
         for t in np.linspace(0.02, 0.98, 11):
-            hyperplane._point = t * hyperplane._normal
-            slice = extruded1.slice(hyperplane)
+            slice = playback.slice_at_time(timeIndex1, t)
             logging.info(f"Slice1 {t:.1f}")
             viewer.list(slice, f"Slice1 {t:.1f}")
         for t in np.linspace(0.02, 0.98, 11):
-            hyperplane._point = t * hyperplane._normal
-            slice = extruded2.slice(hyperplane)
+            slice = playback.slice_at_time(timeIndex2, t)
             logging.info(f"Slice2 {t:.1f}")
             viewer.list(slice, f"Slice2 {t:.1f}")
         viewer.mainloop()
 
-    elif option == "draw":
+    elif args.option == "draw" and args.frames:
+        logging.info("Write robot animation")
+        frames = playback.iter_frames(robots, np.linspace(0.0, 1.0, 11), args.workers or None)
+        playback.write_frames(frames, os.path.join(args.frames, "robots_{index:03d}.solid"))
+
+        logging.info("Load intersection")
+        intersection = pipeline.load_intersection(args, robot1, tValues, robot2, tValues, (0.62, 0.98))
+
+        logging.info("Write intersection slices")
+        slices = playback.iter_time_slices(intersection, np.linspace(0.62, 0.98, 6), prefetch=4)
+        playback.write_frames(slices, os.path.join(args.frames, "intersect_{index:03d}.solid"))
+
+    elif args.option == "draw":
         viewer = Viewer()
         viewer.set_background_color(np.array((1, 1, 1, 1),np.float32))
 
         logging.info("Render robot animation")
-        for t in np.linspace(0.0, 1.0, 11):
-            robot = create_robot(robot1_parameters, t)
-            robot = create_robot(robot2_parameters, t, robot)
-            viewer.list(robot, f"Robots {t:.1f}")
+        for t, frame in playback.iter_frames(robots, np.linspace(0.0, 1.0, 11), args.workers or None):
+            viewer.list(frame, f"Robots {t:.1f}")
+            # Show each frame as it arrives. (Viewer.update redraws the selection but doesn't run Tk's event loop.)
+            viewer.update_idletasks()
         
         logging.info("Load intersection")
-        [intersection] = Solid.load(r"C:\Users\ericb\OneDrive\Desktop\robots_intersection.json")
+        intersection = pipeline.load_intersection(args, robot1, tValues, robot2, tValues, (0.62, 0.98))
 
         logging.info("Slice intersection")
-        hyperplane = Hyperplane.create_axis_aligned(4, 3, 0.0)
-        for t in np.linspace(0.62, 0.98, 6):
-            hyperplane._point = t * hyperplane._normal
-            slice = intersection.slice(hyperplane)
+        for t, slice in playback.iter_time_slices(intersection, np.linspace(0.62, 0.98, 6), prefetch=4):
             logging.info(f"Intersect {t:.1f}")
             viewer.list(slice, f"Intersect {t:.1f}")
+            viewer.update_idletasks()
         viewer.mainloop()
\ No newline at end of file
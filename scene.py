@@ -0,0 +1,110 @@
+import numpy as np
+from bspy import Solid
+from modeler import Modeler
+import dual
+import utils
+import instrument
+
+# Scene graph of an assembly, built once with the same push/pop/translate/rotate/scale/add program as a Modeler,
+# then evaluated for any parameters and t. Arguments to the operations are constants, joint names (the items of
+# the tuple the parameters give), tuples mixing the two, or functions of the joints, such as
+# lambda joints: (0.0, -joints["bite"], 0.5). Parameters are a function of t, whose joints are dual numbers so
+# their rates come along, or a constant tuple of joints, which don't move.
+#
+# Each operation is a node whose parent is the operation before it. A node keeps its transform from the last
+# evaluation, and every part keeps its transformed boundaries, so an evaluation only transforms again the parts
+# below nodes whose transforms changed. Static parts (like a fixed base) are transformed once.
+
+class Node:
+    def __init__(self, parent, operation=None, arguments=()):
+        self.parent = parent
+        self.operation = operation
+        self.arguments = arguments
+        self.local = None
+        self.modeler = None
+
+def resolve(argument, joints):
+    if isinstance(argument, str):
+        return joints[argument]
+    if isinstance(argument, tuple):
+        return tuple(resolve(item, joints) for item in argument)
+    if callable(argument):
+        return argument(joints)
+    return argument
+
+class SceneGraph:
+    def __init__(self, jointNames):
+        self.jointNames = tuple(jointNames)
+        self.root = Node(None)
+        self.nodes = []
+        self.parts = []
+        self.current = self.root
+        self.stack = []
+        self.statistics = {"evaluations" : 0, "transformed" : 0, "cached" : 0}
+
+    def push(self):
+        self.stack.append(self.current)
+
+    def pop(self):
+        self.current = self.stack.pop() if self.stack else self.root
+
+    def reset(self):
+        self.current = self.root
+
+    def add_node(self, operation, *arguments):
+        self.current = Node(self.current, operation, arguments)
+        self.nodes.append(self.current)
+
+    def translate(self, v, dV=(0.0, 0.0, 0.0)):
+        self.add_node(Modeler.translation, v, dV)
+
+    def rotate(self, axis, radians, dRadians=0.0):
+        self.add_node(Modeler.rotation, axis, radians, dRadians)
+
+    def scale(self, v, dV=(0.0, 0.0, 0.0)):
+        self.add_node(Modeler.scaling, v, dV)
+
+    def add(self, part):
+        # Attach part at the current node. Its transformed boundaries are cached here, one entry per add.
+        self.parts.append([self.current, part, None])
+
+    def joints(self, parameters, t):
+        values = dual.call(parameters, t) if callable(parameters) else parameters
+        if len(self.jointNames) == 1:
+            values = (values,)
+        return dict(zip(self.jointNames, values))
+
+    @instrument.traced("SceneGraph.evaluate")
+    def evaluate(self, parameters, t, solid=None):
+        # The assembly for parameters at t, added to solid if given. As with Modeler, t may be an array of time
+        # values, in which case a list of solids is returned, one per t.
+        batch = np.ndim(t) > 0
+        count = len(t) if batch else None
+        if solid is None:
+            solid = [Solid(3, False) for i in range(count)] if batch else Solid(3, False)
+        joints = self.joints(parameters, t)
+        self.statistics["evaluations"] += 1
+
+        # Update the transforms in building order, so parents come first.
+        self.root.modeler = Modeler(count)
+        changed = {id(self.root)} if self.root.local != count else set()
+        self.root.local = count
+        for node in self.nodes:
+            matrix, dMatrix = node.operation(*resolve(node.arguments, joints))
+            if id(node.parent) in changed or node.local is None or not (np.array_equal(matrix, node.local[0]) and np.array_equal(dMatrix, node.local[1])):
+                node.local = (matrix, dMatrix)
+                node.modeler = Modeler(count)
+                node.modeler.matrix = node.parent.modeler.matrix
+                node.modeler.dMatrix = node.parent.modeler.dMatrix
+                node.modeler.multiply(matrix, dMatrix)
+                changed.add(id(node))
+
+        for part in self.parts:
+            node, prototype, transformed = part
+            if transformed is None or id(node) in changed:
+                part[2] = transformed = node.modeler.transform(prototype)
+                self.statistics["transformed"] += 1
+            else:
+                self.statistics["cached"] += 1
+            utils.add_boundaries(solid, transformed)
+        return solid
@@ -0,0 +1,73 @@
+import numpy as np
+from bspy import Solid, Boundary, Hyperplane
+import utils
+
+# Simplification of hyperplane-bounded solids built by adding the boundaries of touching parts into one solid.
+# Boundaries on the same plane are merged into one boundary per orientation. Where oppositely oriented
+# boundaries overlap (the faces two adjacent parts share), the overlap is interior and is removed from both.
+
+def plane_key(manifold, tolerance):
+    # Hashable key shared by coplanar hyperplanes of either orientation (and, for sampled solids, the same motion).
+    normal = manifold._normal
+    dimension = len(normal)
+    # Orient by the first component too large for noise to change its sign.
+    sign = np.sign(normal[np.argmax(np.abs(normal) > 0.5 / np.sqrt(dimension))])
+    key = [sign * normal, [sign * np.dot(normal, manifold._point)]]
+    if hasattr(manifold, "_dP"):
+        key.append(manifold._dP)
+    return tuple(np.round(np.concatenate(key) / tolerance).astype(np.int64).tolist())
+
+def map_domain(domain, matrix, offset):
+    # Domain mapped by u -> matrix @ u + offset. (Solid.transform doesn't flip the normals of 1D solids.)
+    inverseTranspose = np.linalg.inv(matrix).T
+    mapped = Solid(domain.dimension, domain.containsInfinity)
+    for boundary in domain.boundaries:
+        manifold = boundary.manifold
+        normal = inverseTranspose @ manifold._normal
+        normal = normal / np.linalg.norm(normal)
+        tangentSpace = matrix @ manifold._tangentSpace if domain.dimension > 1 else manifold._tangentSpace
+        mapped.add_boundary(Boundary(utils.trusted_hyperplane(normal, matrix @ manifold._point + offset, tangentSpace), boundary.domain))
+    return mapped
+
+def merge_group(group, tolerance):
+    # Merge coplanar boundaries into at most two, one per orientation, parameterized like the first boundary.
+    reference = group[0].manifold
+    inverse = np.linalg.pinv(reference._tangentSpace)
+    domains = {1.0 : None, -1.0 : None}
+    for boundary in group:
+        manifold = boundary.manifold
+        if boundary is group[0]:
+            domain = boundary.domain
+        else:
+            domain = map_domain(boundary.domain, inverse @ manifold._tangentSpace, inverse @ (manifold._point - reference._point))
+        sign = np.sign(np.dot(manifold._normal, reference._normal))
+        domains[sign] = domain if domains[sign] is None else domains[sign].union(domain)
+    if domains[1.0] is not None and domains[-1.0] is not None:
+        domains[1.0], domains[-1.0] = domains[1.0].difference(domains[-1.0]), domains[-1.0].difference(domains[1.0])
+
+    flipped = utils.trusted_hyperplane(-reference._normal, reference._point, reference._tangentSpace)
+    if hasattr(reference, "_dP"):
+        flipped._dP = reference._dP
+    boundaries = []
+    for manifold, domain in ((reference, domains[1.0]), (flipped, domains[-1.0])):
+        if domain:
+            boundaries.append(Boundary(manifold, merge_coplanar(domain, tolerance)))
+    return boundaries
+
+def merge_coplanar(solid, tolerance=1.0e-6):
+    # Return an equivalent solid with coplanar boundaries merged and interior faces removed, or solid itself
+    # if no two of its boundaries are coplanar.
+    if solid.dimension < 2:
+        return solid
+    groups = {}
+    for boundary in solid.boundaries:
+        key = plane_key(boundary.manifold, tolerance) if isinstance(boundary.manifold, Hyperplane) else id(boundary)
+        groups.setdefault(key, []).append(boundary)
+    if len(groups) == len(solid.boundaries):
+        return solid
+
+    merged = Solid(solid.dimension, solid.containsInfinity)
+    for group in groups.values():
+        for boundary in group if len(group) == 1 else merge_group(group, tolerance):
+            merged.add_boundary(boundary)
+    return merged
@@ -0,0 +1,133 @@
+import json
+import numpy as np
+from bspy import Solid, Boundary, Hyperplane
+import utils
+
+# Binary container for hyperplane-bounded solids, an alternative to Solid.save/Solid.load for large results.
+#
+# Layout: an 8-byte magic, an 8-byte little-endian header length, a JSON header, then raw arrays aligned to 64 bytes.
+# The arrays flatten the solid/boundary/domain tree:
+#   solids (S, 4) int64: dimension, containsInfinity, first boundary, boundary count.
+#   boundaries (B, 2) int64: offset of the boundary's hyperplane in floats, index of its domain solid.
+#   floats (F,) float64: normal, point, and tangent space of each hyperplane, back to back.
+#   timeRanges (B, 2) float64: extent of each boundary along the last axis of its solid.
+# Domain solids shared by several boundaries are stored once. Loading maps the arrays with numpy.memmap,
+# so hyperplane arrays are views into the file rather than copies.
+
+magic = b"MODELER1"
+alignment = 64
+
+def tangent_size(dimension):
+    return 1 if dimension == 1 else dimension * (dimension - 1)
+
+def flatten(solids):
+    solidRows = []
+    boundaryRows = []
+    floats = []
+    floatCount = [0]
+    timeRanges = []
+    solidIndices = {}
+
+    def add_solid(solid):
+        if id(solid) in solidIndices:
+            return solidIndices[id(solid)]
+        index = len(solidRows)
+        solidIndices[id(solid)] = index
+        first = len(boundaryRows)
+        solidRows.append((solid.dimension, int(solid.containsInfinity), first, len(solid.boundaries)))
+        boundaryRows.extend([None] * len(solid.boundaries))
+        timeRanges.extend([(-np.inf, np.inf)] * len(solid.boundaries))
+        for i, boundary in enumerate(solid.boundaries):
+            manifold = boundary.manifold
+            if not isinstance(manifold, Hyperplane): raise ValueError("Only hyperplane-bounded solids can be stored")
+            if manifold._tangentSpace.size != tangent_size(solid.dimension): raise ValueError("Unexpected tangent space shape")
+            offset = floatCount[0]
+            for array in (manifold._normal, manifold._point, manifold._tangentSpace):
+                floats.append(np.ravel(array).astype(np.float64))
+                floatCount[0] += floats[-1].size
+            bounds = utils.boundary_bounds(boundary)
+            if bounds is not None:
+                timeRanges[first + i] = bounds[-1]
+            boundaryRows[first + i] = (offset, add_solid(boundary.domain))
+        return index
+
+    roots = [add_solid(solid) for solid in solids]
+    arrays = {
+        "solids" : np.array(solidRows, np.int64).reshape(-1, 4),
+        "boundaries" : np.array(boundaryRows, np.int64).reshape(-1, 2),
+        "floats" : np.concatenate(floats) if floats else np.zeros(0),
+        "timeRanges" : np.array(timeRanges, np.float64).reshape(-1, 2),
+    }
+    return roots, arrays
+
+def aligned(size):
+    return (size + alignment - 1) // alignment * alignment
+
+def save(fileName, *solids):
+    roots, arrays = flatten(solids)
+    header = {"roots" : roots, "arrays" : {}}
+    # Array offsets are relative to the start of the data, which begins at the first aligned position after the header.
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {"dtype" : array.dtype.str, "shape" : array.shape, "offset" : offset}
+        offset += aligned(array.nbytes)
+    headerBytes = json.dumps(header).encode("utf-8")
+    start = aligned(len(magic) + 8 + len(headerBytes))
+
+    with open(fileName, "wb") as file:
+        file.write(magic)
+        file.write(np.uint64(len(headerBytes)).tobytes())
+        file.write(headerBytes)
+        for name, array in arrays.items():
+            file.seek(start + header["arrays"][name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+        # Pad to the aligned end, so every array lies entirely within the file.
+        file.truncate(start + offset)
+
+def open_arrays(fileName):
+    with open(fileName, "rb") as file:
+        if file.read(len(magic)) != magic: raise ValueError("Not a solid container file")
+        headerLength = int(np.frombuffer(file.read(8), np.uint64)[0])
+        header = json.loads(file.read(headerLength).decode("utf-8"))
+    start = aligned(len(magic) + 8 + headerLength)
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        shape = tuple(entry["shape"])
+        if np.prod(shape) == 0:
+            arrays[name] = np.zeros(shape, entry["dtype"])
+        else:
+            arrays[name] = np.memmap(fileName, entry["dtype"], "r", start + entry["offset"], shape)
+    return header["roots"], arrays
+
+def load(fileName, tRange=None):
+    # Load the solids in fileName. With tRange = (t0, t1), top-level solids keep only the boundaries whose extent
+    # along the last (time) axis overlaps [t0, t1]: enough to slice the solids at any t within that range.
+    roots, arrays = open_arrays(fileName)
+    # The small index tables are read into lists; the floats stay mapped (as a plain ndarray view, which slices faster).
+    solidRows = arrays["solids"].tolist()
+    boundaryRows = arrays["boundaries"].tolist()
+    timeRanges = arrays["timeRanges"].tolist()
+    floats = np.asarray(arrays["floats"])
+    solids = {}
+
+    def build_solid(index, tRange=None):
+        if tRange is None and index in solids:
+            return solids[index]
+        dimension, containsInfinity, first, count = solidRows[index]
+        solid = Solid(dimension, bool(containsInfinity))
+        size = tangent_size(dimension)
+        for i in range(first, first + count):
+            if tRange is not None and (timeRanges[i][1] < tRange[0] or timeRanges[i][0] > tRange[1]):
+                continue
+            offset, domainIndex = boundaryRows[i]
+            normal = floats[offset:offset + dimension]
+            point = floats[offset + dimension:offset + 2 * dimension]
+            tangentSpace = floats[offset + 2 * dimension:offset + 2 * dimension + size]
+            if dimension > 1:
+                tangentSpace = tangentSpace.reshape(dimension, dimension - 1)
+            solid.add_boundary(Boundary(utils.trusted_hyperplane(normal, point, tangentSpace), build_solid(domainIndex)))
+        if tRange is None:
+            solids[index] = solid
+        return solid
+
+    return [build_solid(index, tRange) for index in roots]
@@ -1,5 +1,10 @@
+import itertools
+from collections import OrderedDict
 import numpy as np
 from bspy import Solid, Boundary, Hyperplane
+import instrument
+import simplify
+import planar
 
 def create_hyperplane(normal, offset):
     normalizedNormal = np.atleast_1d(normal)
@@ -10,38 +15,261 @@ def create_hyperplane(normal, offset):
     else:
         return Hyperplane(normalizedNormal, offset * normalizedNormal, 0.0)
 
+def trusted_hyperplane(normal, point, tangentSpace):
+    # Construct a hyperplane whose normal is already known to be orthogonal to its tangent space, skipping the constructor's check.
+    hyperplane = Hyperplane.__new__(Hyperplane)
+    hyperplane._normal = np.atleast_1d(normal)
+    hyperplane._point = np.atleast_1d(point)
+    hyperplane._tangentSpace = np.atleast_1d(tangentSpace)
+    return hyperplane
+
 def hyperplane_domain_from_point(hyperplane, point):
     return np.linalg.inv(hyperplane._tangentSpace.T @ hyperplane._tangentSpace) @ hyperplane._tangentSpace.T @ (point - hyperplane._point)
 
-def create_faceted_solid_from_points(points):
+def add_boundaries(solid, transformed):
+    # Add the boundaries of a transformed part to solid, or sample by sample for the lists of solids a batched Modeler returns.
+    if isinstance(solid, Solid):
+        for boundary in transformed.boundaries:
+            solid.add_boundary(boundary)
+    else:
+        for sampleSolid, sampleTransformed in zip(solid, transformed):
+            add_boundaries(sampleSolid, sampleTransformed)
+
+def solid_bounds(solid):
+    bounds = None
+    for boundary in solid.boundaries:
+        boundaryBounds = boundary_bounds(boundary)
+        if boundaryBounds is None:
+            return None
+        if bounds is None:
+            bounds = boundaryBounds.copy()
+        else:
+            bounds[:, 0] = np.minimum(bounds[:, 0], boundaryBounds[:, 0])
+            bounds[:, 1] = np.maximum(bounds[:, 1], boundaryBounds[:, 1])
+    return bounds
+
+def boundary_bounds(boundary):
+    # Exact axis-aligned box of a hyperplane boundary, computed from the box of its domain and cached on the boundary.
+    # (Boundary.bounds only maps two corners of the domain box, so it can be too small for rotated tangent spaces.)
+    if not hasattr(boundary, "_bounds"):
+        manifold = boundary.manifold
+        if not isinstance(manifold, Hyperplane):
+            boundary._bounds = boundary.bounds
+        elif boundary.domain.dimension == 0:
+            boundary._bounds = np.array(((manifold._point[0], manifold._point[0]),))
+        elif boundary.domain.containsInfinity:
+            boundary._bounds = None
+        else:
+            domainBounds = solid_bounds(boundary.domain)
+            if domainBounds is None:
+                boundary._bounds = None
+            else:
+                center = manifold._tangentSpace @ (0.5 * (domainBounds[:, 0] + domainBounds[:, 1])) + manifold._point
+                halfWidth = np.abs(manifold._tangentSpace) @ (0.5 * (domainBounds[:, 1] - domainBounds[:, 0]))
+                boundary._bounds = np.stack((center - halfWidth, center + halfWidth), axis=1)
+    return boundary._bounds
+
+def boundary_vertices(boundary):
+    # Vertices (with repeats) of a hyperplane boundary with a bounded domain, one per row. A linear function,
+    # such as time, is smallest over the boundary at one of them.
+    manifold = boundary.manifold
+    if boundary.domain.dimension == 0:
+        return manifold._point[np.newaxis]
+    domainVertices = [boundary_vertices(domainBoundary) for domainBoundary in boundary.domain.boundaries]
+    if not domainVertices:
+        return np.zeros((0, len(manifold._point)))
+    return np.concatenate(domainVertices) @ manifold._tangentSpace.T + manifold._point
+
+def trusted_boundary(manifold, domain, bounds):
+    # Construct a boundary whose range bounds are already known, skipping the constructor's checks and bounds computation.
+    boundary = Boundary.__new__(Boundary)
+    boundary.manifold = manifold
+    boundary.domain = domain
+    boundary.bounds = bounds
+    return boundary
+
+def create_interval(lower, upper):
+    # The number-line solid [lower, upper], with the boundaries create_hyperplane(-1.0, -lower) and create_hyperplane(1.0, upper).
+    interval = Solid(1, False)
+    interval.add_boundary(trusted_boundary(trusted_hyperplane(-1.0, lower, 0.0), Solid(0, True), np.array(((lower, lower),))))
+    interval.add_boundary(trusted_boundary(trusted_hyperplane(1.0, upper, 0.0), Solid(0, True), np.array(((upper, upper),))))
+    return interval
+
+def offset_solid(solid, distance, embedding=None):
+    # Move every boundary of a hyperplane-bounded solid outward by distance and grow its domain by distance
+    # (recursively), keeping any _dP. Domains are grown in the units of the solid: embedding maps domain
+    # parameters to the solid's coordinates. For right-angled parts (see right_angled) this is the solid padded by
+    # distance; elsewhere the faces overshoot or fall short where they meet.
+    offset = Solid(solid.dimension, solid.containsInfinity)
+    for boundary in solid.boundaries:
+        manifold = boundary.manifold
+        if not isinstance(manifold, Hyperplane): raise ValueError("Only hyperplane-bounded solids can be offset")
+        normal = np.reshape(manifold._normal, -1)
+        shift = distance if embedding is None else distance / np.linalg.norm(embedding @ normal)
+        domain = boundary.domain
+        if domain.dimension > 0:
+            tangentSpace = np.reshape(manifold._tangentSpace, (solid.dimension, -1))
+            domain = offset_solid(domain, distance, tangentSpace if embedding is None else embedding @ tangentSpace)
+        hyperplane = trusted_hyperplane(manifold._normal, manifold._point + shift * manifold._normal, manifold._tangentSpace)
+        if hasattr(manifold, "_dP"):
+            hyperplane._dP = manifold._dP
+        offset.add_boundary(Boundary(hyperplane, domain))
+    return offset
+
+def right_angled(solid, tolerance=1.0e-6):
+    # Whether a hyperplane-bounded solid is made of right-angled convex parts, such as (scaled and rotated) boxes,
+    # whose boundaries are added to one solid. At the middle of every ridge of every boundary, another boundary
+    # must meet it at a right angle on the inside (convex), and no boundary may meet it at another angle.
+    if solid.dimension < 2:
+        return True
+    boundaries = [boundary for boundary in solid.boundaries if isinstance(boundary.manifold, Hyperplane)]
+    if len(boundaries) < len(solid.boundaries):
+        return False
+    normals = np.array([boundary.manifold._normal for boundary in boundaries])
+    points = np.array([boundary.manifold._point for boundary in boundaries])
+    boxes = [boundary_bounds(boundary) for boundary in boundaries]
+    if any(box is None for box in boxes):
+        return False
+    boxes = np.array(boxes)
+    for boundary in boundaries:
+        manifold = boundary.manifold
+        tangentSpace = np.reshape(manifold._tangentSpace, (solid.dimension, -1))
+        for ridge in boundary.domain.boundaries:
+            ridgeNormal = np.reshape(ridge.manifold._normal, -1)
+            outward = tangentSpace @ ridgeNormal
+            if ridge.domain.dimension > 0:
+                ridgeBounds = solid_bounds(ridge.domain)
+                if ridgeBounds is None:
+                    return False
+                ridgeTangent = tangentSpace @ np.reshape(ridge.manifold._tangentSpace, (solid.dimension - 1, -1))
+                # The ridge must move straight out when its domain is grown (see offset_solid).
+                if np.any(np.abs(ridgeTangent.T @ outward) > tolerance * np.linalg.norm(outward) * np.linalg.norm(ridgeTangent, axis=0)):
+                    return False
+                middle = ridge.manifold._point + ridge.manifold._tangentSpace @ (0.5 * (ridgeBounds[:, 0] + ridgeBounds[:, 1]))
+            else:
+                middle = ridge.manifold._point
+            # Boundaries through the middle of the ridge, other than coplanar ones (like faces of touching parts).
+            point = manifold._point + tangentSpace @ np.reshape(middle, -1)
+            onPlane = np.abs(np.sum(normals * (point - points), axis=1)) < tolerance
+            inBox = np.all((boxes[:, :, 0] <= point + tolerance) & (boxes[:, :, 1] >= point - tolerance), axis=1)
+            neighbors = normals[onPlane & inBox]
+            cosines = neighbors @ manifold._normal
+            neighbors, cosines = neighbors[np.abs(cosines) < 1.0 - tolerance], cosines[np.abs(cosines) < 1.0 - tolerance]
+            if np.any(np.abs(cosines) > tolerance) or not np.any(neighbors @ outward > 0.0):
+                return False
+    return True
+
+@instrument.traced("create_faceted_solid_from_points")
+def create_faceted_solid_from_points(points, zRange=None):
     # create_faceted_solid_from_points only works for dimension 2 so far.
+    # With zRange = (z0, z1), return the prism extrude_path(solid, ((0, 0, z0), (0, 0, z1))) would make instead,
+    # built directly (the lateral faces have rectangular domains).
     dimension = 2
+    points = np.array(points, float)
     assert len(points) > 2
-    assert len(points[0]) == dimension
+    assert points.shape[1] == dimension
+
+    # Compute every edge (from the previous point to the point) at once, skipping repeated points.
+    previousPoints = np.roll(points, 1, axis=0)
+    vectors = points - previousPoints
+    lengths = np.linalg.norm(vectors, axis=1)
+    keep = lengths > 0.0
+    points, previousPoints, vectors, lengths = points[keep], previousPoints[keep], vectors[keep], lengths[keep]
+    normals = np.stack((-vectors[:, 1], vectors[:, 0]), axis=1) / lengths[:, np.newaxis]
+    tangents = np.stack((normals[:, 1], -normals[:, 0]), axis=1)
+    hyperplanePoints = np.sum(normals * points, axis=1)[:, np.newaxis] * normals
+    # The tangents are unit length, so domain coordinates are just projections onto them.
+    previousPointDomains = np.sum(tangents * (previousPoints - hyperplanePoints), axis=1)
+    pointDomains = np.sum(tangents * (points - hyperplanePoints), axis=1)
+    lowerDomains = np.minimum(previousPointDomains, pointDomains).tolist()
+    upperDomains = np.maximum(previousPointDomains, pointDomains).tolist()
+    bounds = np.stack((np.minimum(previousPoints, points), np.maximum(previousPoints, points)), axis=2)
 
     solid = Solid(dimension, False)
-    previousPoint = np.array(points[len(points)-1])
-    for point in points:
-        point = np.array(point)
-        vector = point - previousPoint
-        normal = np.array([-vector[1], vector[0]])
-        normal = normal / np.linalg.norm(normal)
-        hyperplane = create_hyperplane(normal,np.dot(normal,point))
-        domain = Solid(dimension-1, False)
-        previousPointDomain = hyperplane_domain_from_point(hyperplane, previousPoint)
-        pointDomain = hyperplane_domain_from_point(hyperplane, point)
-        if previousPointDomain < pointDomain:
-            domain.add_boundary(Boundary(create_hyperplane(-1.0, -previousPointDomain), Solid(dimension-2, True)))
-            domain.add_boundary(Boundary(create_hyperplane(1.0, pointDomain), Solid(dimension-2, True)))
-        else:
-            domain.add_boundary(Boundary(create_hyperplane(-1.0, -pointDomain), Solid(dimension-2, True)))
-            domain.add_boundary(Boundary(create_hyperplane(1.0, previousPointDomain), Solid(dimension-2, True)))
-        solid.add_boundary(Boundary(hyperplane, domain))
-        previousPoint = point
+    edgeDomains = []
+    for normal, point, tangent, lower, upper, edgeBounds in zip(normals, hyperplanePoints, tangents, lowerDomains, upperDomains, bounds):
+        edgeDomains.append(create_interval(lower, upper))
+        solid.add_boundary(trusted_boundary(trusted_hyperplane(normal, point, tangent[:, np.newaxis]), edgeDomains[-1], edgeBounds))
+    if zRange is None:
+        return solid
+
+    z0, z1 = zRange
+    extent = z1 - z0
+    extrusion = Solid(dimension + 1, False)
+    # Lateral faces: each edge extruded along z, over the domain [lower, upper] x [0, extent].
+    extentDomain = create_interval(0.0, extent)
+    sideTangent = np.array(((0.0,), (1.0,)))
+    startCap = Hyperplane.create_axis_aligned(dimension, dimension - 1, 0.0, True)
+    endCap = Hyperplane.create_axis_aligned(dimension, dimension - 1, 0.0, False).translate((0.0, extent))
+    normals = np.hstack((normals, np.zeros((len(normals), 1))))
+    hyperplanePoints = np.hstack((hyperplanePoints, np.full((len(hyperplanePoints), 1), z0)))
+    tangentSpaces = np.zeros((len(tangents), dimension + 1, dimension))
+    tangentSpaces[:, :dimension, 0] = tangents
+    tangentSpaces[:, dimension, 1] = 1.0
+    bounds = np.concatenate((bounds, np.broadcast_to((z0, z1), (len(bounds), 1, 2))), axis=1)
+    for normal, point, tangentSpace, lower, upper, edgeDomain, faceBounds in zip(normals, hyperplanePoints, tangentSpaces, lowerDomains, upperDomains, edgeDomains, bounds):
+        domain = Solid(dimension, False)
+        domain.add_boundary(trusted_boundary(trusted_hyperplane((-1.0, 0.0), (lower, 0.0), sideTangent), extentDomain, np.array(((lower, lower), (0.0, extent)))))
+        domain.add_boundary(trusted_boundary(trusted_hyperplane((1.0, 0.0), (upper, 0.0), sideTangent), extentDomain, np.array(((upper, upper), (0.0, extent)))))
+        domain.add_boundary(trusted_boundary(startCap, edgeDomain, np.array(((lower, upper), (0.0, 0.0)))))
+        domain.add_boundary(trusted_boundary(endCap, edgeDomain, np.array(((lower, upper), (extent, extent)))))
+        extrusion.add_boundary(trusted_boundary(trusted_hyperplane(normal, point, tangentSpace), domain, faceBounds))
+
+    # Add end cap boundaries
+    extrusion.add_boundary(Boundary(Hyperplane.create_axis_aligned(dimension + 1, dimension, 0.0, True).translate((0.0, 0.0, z0)), solid))
+    extrusion.add_boundary(Boundary(Hyperplane.create_axis_aligned(dimension + 1, dimension, 0.0, False).translate((0.0, 0.0, z1)), solid))
+    return extrusion
+
+def domain_signature(solid):
+    # Hashable description of a hyperplane-bounded solid's exact geometry, or None if it has other manifolds.
+    # Cached on the solid, like boundary bounds, since domains aren't changed once built.
+    if not hasattr(solid, "_signature"):
+        signature = [solid.dimension, solid.containsInfinity]
+        for boundary in solid.boundaries:
+            manifold = boundary.manifold
+            domainSignature = domain_signature(boundary.domain) if isinstance(manifold, Hyperplane) else None
+            if domainSignature is None:
+                signature = None
+                break
+            signature.append((manifold._normal.tobytes(), manifold._point.tobytes(), np.asarray(manifold._tangentSpace).tobytes(), domainSignature))
+        solid._signature = None if signature is None else tuple(signature)
+    return solid._signature
+
+# Extruded domains by domain signature and extent, least recently used first. Hypercube faces and the faces of a part
+# in every time sample share domain shapes, so most domain extrusions are repeats. Cached extrusions are shared.
+domainCacheSize = 4096
+domainExtrusions = OrderedDict()
+domainCacheStatistics = {"hits" : 0, "misses" : 0}
+
+def extrude_domain(domain, extent):
+    # extrude_path(domain, ((0, ..., 0), (0, ..., extent))), memoized by the domain's geometry and extent.
+    signature = domain_signature(domain)
+    key = None if signature is None else (signature, float(extent))
+    if key in domainExtrusions:
+        domainCacheStatistics["hits"] += 1
+        domainExtrusions.move_to_end(key)
+        return domainExtrusions[key]
+    domainPath = np.zeros((2, domain.dimension + 1))
+    domainPath[1, domain.dimension] = extent
+    extrudedDomain = extrude_path(domain, domainPath)
+    if key is not None:
+        domainCacheStatistics["misses"] += 1
+        domainExtrusions[key] = extrudedDomain
+        if len(domainExtrusions) > domainCacheSize:
+            domainExtrusions.popitem(last=False)
+    return extrudedDomain
 
-    return solid
+def domain_cache_info():
+    return dict(domainCacheStatistics, size=len(domainExtrusions), maxSize=domainCacheSize)
 
+def domain_cache_clear():
+    domainExtrusions.clear()
+    domainCacheStatistics.update(hits=0, misses=0)
+
+@instrument.traced("extrude_path")
 def extrude_path(solid, path):
+    if isinstance(solid, planar.PlanarSolid):
+        return planar.extrude_path(solid, path)
     assert len(path) > 1
     assert solid.dimension+1 == len(path[0])
     
@@ -77,13 +305,7 @@ def extrude_path(solid, path):
             # Construct a domain for the extruded boundary
             if boundary.domain.dimension > 0:
                 # Extrude the boundary's domain to include path domain
-                domainPath = []
-                domainPoint = np.zeros(solid.dimension)
-                domainPath.append(domainPoint)
-                domainPoint = np.zeros(solid.dimension)
-                domainPoint[solid.dimension-1] = extent
-                domainPath.append(domainPoint)
-                extrudedDomain = extrude_path(boundary.domain, domainPath)
+                extrudedDomain = extrude_domain(boundary.domain, extent)
             else:
                 extrudedDomain = Solid(solid.dimension, False)
                 extrudedDomain.add_boundary(Boundary(create_hyperplane(-1.0, 0.0), Solid(0, True)))
@@ -104,15 +326,97 @@ def extrude_path(solid, path):
 
     return extrusion
 
-def extrude_time(solidFunction, tValues):
+def interpolation_drift(solid, nextSolid, dt, nextDt=0.0):
+    # Largest distance, over the corners of each boundary's domain, between the linear motion extrude_time
+    # interpolates from a sample (point plus _dP times dt) and the boundary's true position dt later.
+    # With nextDt, compare with the motion interpolated from nextSolid, nextDt after it, instead.
+    assert len(solid.boundaries) == len(nextSolid.boundaries)
+    drift = 0.0
+    for boundary, nextBoundary in zip(solid.boundaries, nextSolid.boundaries):
+        manifold = boundary.manifold
+        nextManifold = nextBoundary.manifold
+        domainBounds = solid_bounds(boundary.domain)
+        if domainBounds is None:
+            corners = np.zeros((1, boundary.domain.dimension))
+        else:
+            corners = np.array(list(itertools.product(*domainBounds)))
+        predicted = corners @ manifold._tangentSpace.T + manifold._point + dt * manifold._dP
+        actual = corners @ nextManifold._tangentSpace.T + nextManifold._point + nextDt * nextManifold._dP
+        drift = max(drift, np.max(np.linalg.norm(actual - predicted, axis=1)))
+    return drift
+
+def advance_sample(solid, dt):
+    # The sample as extrude_time interpolates it dt later: every boundary moved by its _dP times dt (same rates).
+    if isinstance(solid, planar.PlanarSolid):
+        return planar.PlanarSolid(solid.dimension, solid.containsInfinity, solid.normals, solid.points + dt * solid.dPoints,
+            solid.tangentSpaces, solid.domains, solid.domainIndices, solid.dPoints)
+    advanced = Solid(solid.dimension, solid.containsInfinity)
+    for boundary in solid.boundaries:
+        manifold = boundary.manifold
+        hyperplane = trusted_hyperplane(manifold._normal, manifold._point + dt * manifold._dP, manifold._tangentSpace)
+        hyperplane._dP = manifold._dP
+        advanced.add_boundary(Boundary(hyperplane, boundary.domain))
+    return advanced
+
+def adapt_time_values(solidFunction, tValues, tolerance, maxDepth=8):
+    # Split each interval of tValues in half until the interpolation drift at its midpoint and end is within tolerance.
     assert(len(tValues) >= 2)
+    adaptedValues = [tValues[0]]
+
+    def refine(t, solid, tNext, nextSolid, depth):
+        tMid = 0.5 * (t + tNext)
+        midSolid = solidFunction(tMid)
+        if depth < maxDepth and max(interpolation_drift(solid, midSolid, tMid - t), interpolation_drift(solid, nextSolid, tNext - t)) > tolerance:
+            refine(t, solid, tMid, midSolid, depth + 1)
+            refine(tMid, midSolid, tNext, nextSolid, depth + 1)
+        else:
+            adaptedValues.append(tNext)
 
-    # Start with solid cap.
     t = tValues[0]
     solid = solidFunction(t)
+    for tNext in tValues[1:]:
+        nextSolid = solidFunction(tNext)
+        refine(t, solid, tNext, nextSolid, 0)
+        t = tNext
+        solid = nextSolid
+
+    return adaptedValues
+
+@instrument.traced("extrude_time")
+def extrude_time(solidFunction, tValues, tolerance=None, maxDepth=8, vectorized=False, merge=True):
+    assert(len(tValues) >= 2)
+
+    # A vectorized solidFunction takes an array of t values and returns a list of solids, sampling them all in one pass.
+    samples = {}
+    if vectorized:
+        samples.update(zip(tValues, solidFunction(np.array(tValues, float))))
+    def sampledFunction(t):
+        if t not in samples:
+            samples[t] = solidFunction(t)
+        return samples[t]
+
+    # PlanarSolid samples are extruded with array operations (no adaptive sampling or merging).
+    if isinstance(sampledFunction(tValues[0]), planar.PlanarSolid):
+        assert tolerance is None
+        return planar.extrude_time(sampledFunction, tValues)
+
+    # Adaptively refine tValues, reusing the samples taken while measuring drift.
+    if tolerance is not None:
+        tValues = adapt_time_values(sampledFunction, tValues, tolerance, maxDepth)
+
+    # Merge the coplanar boundaries of touching parts in each sample, since every boundary becomes one per slab.
+    # Only the extrusion sees the merged samples: drift is measured on the unmerged ones, whose boundaries
+    # correspond one to one, and collision.padded_extrusion pads those too.
+    def mergedFunction(t):
+        return simplify.merge_coplanar(sampledFunction(t)) if merge else sampledFunction(t)
+
+    # Start with solid cap.
+    t = tValues[0]
+    solid = mergedFunction(t)
     extrusion = Solid(solid.dimension + 1, solid.containsInfinity)
     cap = Hyperplane.create_axis_aligned(extrusion.dimension, solid.dimension, -t, True)
     extrusion.add_boundary(Boundary(cap, solid))
+    boundary_bounds(extrusion.boundaries[-1])
 
     # Interpolate boundaries along time dimension.
     for tNext in tValues[1:]:
@@ -134,24 +438,20 @@ def extrude_time(solidFunction, tValues):
             extruded_tangentSpace[:solid.dimension, solid.dimension-1] = manifold._dP
             extruded_tangentSpace[solid.dimension, solid.dimension-1] = 1.0
             # Construct the domain (extrude existing domain to add time)
-            domainPath = []
-            domainPoint = np.zeros(solid.dimension)
-            domainPoint[solid.dimension-1] = 0
-            domainPath.append(domainPoint)
-            domainPoint = np.zeros(solid.dimension)
-            domainPoint[solid.dimension-1] = tNext - t
-            domainPath.append(domainPoint)
-            extrudedDomain = extrude_path(boundary.domain, domainPath)
+            extrudedDomain = extrude_domain(boundary.domain, tNext - t)
             # Add extruded boundary
             extrudedHyperplane = Hyperplane(extruded_normal, extruded_point, extruded_tangentSpace)
             extrusion.add_boundary(Boundary(extrudedHyperplane, extrudedDomain))
+            # Record the (x, y, z, t) box of the extruded boundary for broad-phase culling.
+            boundary_bounds(extrusion.boundaries[-1])
         
         # Compute next sample.
         t = tNext
-        solid = solidFunction(t)
+        solid = mergedFunction(t)
 
     # End with solid cap.
     cap = Hyperplane.create_axis_aligned(extrusion.dimension, solid.dimension, t, False)
     extrusion.add_boundary(Boundary(cap, solid))
+    boundary_bounds(extrusion.boundaries[-1])
     
     return extrusion
@@ -0,0 +1,158 @@
+import functools
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from bspy import Solid
+import utils
+import planar
+import parallel
+import instrument
+
+# Collision checks between many movers sharing a workcell.
+#
+# Each mover is a solid function and its time samples, e.g. (robots.robot1, tValues) or, for a parameterized
+# assembly, (functools.partial(robots.create_robot, robots.robot1_parameters), tValues). Between samples a mover
+# is extruded along its rates (see utils.extrude_time), so the space it sweeps over a time slab lies in the
+# bounding box of that slab's extrusion. These space-time slab boxes, one per mover per slab, go into a uniform
+# hash grid over (x, y, z, t). Only slabs of two movers that share a grid cell and whose boxes overlap are
+# intersected exactly, so movers that are never near each other cost only their slab extrusions.
+
+class Mover:
+    def __init__(self, name, solidFunction, tValues):
+        self.name = name
+        self.solidFunction = solidFunction
+        self.tValues = tuple(float(t) for t in tValues)
+
+def extrusion_bounds(extrusion):
+    # Exact bounds of an extrusion (PlanarSolid.bounds only maps two domain corners), infinite if unbounded.
+    if isinstance(extrusion, planar.PlanarSolid):
+        extrusion = extrusion.to_solid()
+    bounds = utils.solid_bounds(extrusion)
+    if bounds is None:
+        bounds = np.full((extrusion.dimension, 2), (-np.inf, np.inf))
+    return bounds
+
+def slab_boxes(mover):
+    # Space-time boxes (dimension + 1, 2) of the slabs between consecutive samples of mover. Each is the box of
+    # the slab's extrusion, which moves along the start sample's rates and so can leave the end samples' boxes.
+    samples = {}
+    def sampled(t):
+        if t not in samples:
+            samples[t] = mover.solidFunction(t)
+        return samples[t]
+    return [extrusion_bounds(utils.extrude_time(sampled, (t0, t1))) for t0, t1 in zip(mover.tValues[:-1], mover.tValues[1:])]
+
+class HashGrid:
+    # Uniform grid over space-time boxes, hashed by integer cell coordinates. Cells default to the median box
+    # size along each axis, so a typical box covers a few cells. Boxes that would cover more than maxCells
+    # (or are unbounded) are kept aside and checked against every other box instead.
+    def __init__(self, boxes, cellSize=None, maxCells=4096):
+        finite = [box for box in boxes if np.all(np.isfinite(box))]
+        if cellSize is None:
+            extents = np.array([box[:, 1] - box[:, 0] for box in finite]) if finite else np.ones((1, len(boxes[0])))
+            cellSize = np.median(extents, axis=0)
+        self.cellSize = np.maximum(np.asarray(cellSize, float), 1.0e-6)
+        self.cells = {}
+        self.unbounded = []
+        for i, box in enumerate(boxes):
+            if not np.all(np.isfinite(box)):
+                self.unbounded.append(i)
+                continue
+            lower = np.floor(box[:, 0] / self.cellSize).astype(int)
+            upper = np.floor(box[:, 1] / self.cellSize).astype(int)
+            if np.prod(upper - lower + 1.0) > maxCells:
+                self.unbounded.append(i)
+                continue
+            for cell in itertools.product(*(range(l, u + 1) for l, u in zip(lower, upper))):
+                self.cells.setdefault(cell, []).append(i)
+
+    def pairs(self, boxes, tolerance=1.0e-9):
+        # Index pairs (i, j), i < j, of boxes that share a cell and overlap.
+        pairs = set()
+        candidates = itertools.chain.from_iterable(itertools.combinations(items, 2) for items in self.cells.values() if len(items) > 1)
+        # Boxes kept aside are only paired with each other box, not every box with every other.
+        candidates = itertools.chain(candidates, ((i, j) for i in self.unbounded for j in range(len(boxes)) if j != i))
+        for i, j in candidates:
+            i, j = min(i, j), max(i, j)
+            if (i, j) not in pairs and not Solid.disjoint_bounds(boxes[i] + (-tolerance, tolerance), boxes[j]):
+                pairs.add((i, j))
+        return pairs
+
+def time_range(solid):
+    # Earliest and latest time of a bounded space-time solid, from its boundary vertices (its box can be looser).
+    vertices = np.concatenate([utils.boundary_vertices(boundary) for boundary in solid.boundaries])
+    return (vertices[:, -1].min(), vertices[:, -1].max())
+
+def overlapping_slabs(mover1, mover2, windows):
+    # Merged slabs of the two movers that overlap one of the time windows for a positive time.
+    groups = []
+    for group in parallel.slab_groups(mover1.tValues, mover2.tValues):
+        if any(min(group[-1], end) - max(group[0], start) > 0.0 for start, end in windows):
+            groups.append(group)
+    return groups
+
+@instrument.traced("workcell.check")
+def check(movers, maxWorkers=1, cellSize=None):
+    # Check every pair of movers for collisions. Returns a report per pair: a dict with the pair of names, the
+    # slabs intersected exactly (none if their swept boxes never meet), whether they collide, the time range of
+    # the collision, and the space-time intersection.
+    boxes = []
+    owners = []
+    for m, mover in enumerate(movers):
+        for box in slab_boxes(mover):
+            boxes.append(box)
+            owners.append(m)
+    grid = HashGrid(boxes, cellSize)
+    windows = {}
+    for i, j in grid.pairs(boxes):
+        if owners[i] != owners[j]:
+            pair = (min(owners[i], owners[j]), max(owners[i], owners[j]))
+            windows.setdefault(pair, []).append((max(boxes[i][-1, 0], boxes[j][-1, 0]), min(boxes[i][-1, 1], boxes[j][-1, 1])))
+    logging.info(f"{len(windows)} of {len(movers) * (len(movers) - 1) // 2} mover pairs overlap in the grid")
+
+    jobs = []
+    for (m1, m2), pairWindows in sorted(windows.items()):
+        mover1, mover2 = movers[m1], movers[m2]
+        for group in overlapping_slabs(mover1, mover2, pairWindows):
+            jobs.append(((m1, m2), group, (functools.partial(parallel.sample_at, mover1.solidFunction, tuple(mover1.tValues)),
+                parallel.restrict_time_values(mover1.tValues, group[0], group[-1]),
+                functools.partial(parallel.sample_at, mover2.solidFunction, tuple(mover2.tValues)),
+                parallel.restrict_time_values(mover2.tValues, group[0], group[-1]))))
+    arguments = list(zip(*(job[2] for job in jobs))) or [()] * 4
+    if maxWorkers == 1 or len(jobs) <= 1:
+        solids = list(map(parallel.intersect_slabs, *arguments))
+    else:
+        with ProcessPoolExecutor(maxWorkers) as executor:
+            solids = list(executor.map(parallel.intersect_slabs, *arguments))
+
+    reports = {pair : {"pair" : (movers[pair[0]].name, movers[pair[1]].name), "slabs" : [], "pieces" : []}
+        for pair in itertools.combinations(range(len(movers)), 2)}
+    for (pair, group, jobArguments), solid in zip(jobs, solids):
+        report = reports[pair]
+        report["slabs"].append((group[0], group[-1]))
+        if solid:
+            report["pieces"].append((group[0], group[-1], solid))
+    for report in reports.values():
+        pieces = report.pop("pieces")
+        # Only pieces from adjacent slabs share caps.
+        seams = [start for (previousStart, previousEnd, previous), (start, end, solid) in zip(pieces, pieces[1:]) if previousEnd == start]
+        report["collides"] = bool(pieces)
+        report["intersection"] = parallel.stitch_slabs([piece[2] for piece in pieces], seams) if pieces else None
+        report["tRange"] = time_range(report["intersection"]) if pieces else None
+    return [reports[pair] for pair in sorted(reports)]
+
+def summary(reports):
+    # One line per pair, for logging.
+    lines = []
+    for report in reports:
+        name1, name2 = report["pair"]
+        if not report["slabs"]:
+            lines.append(f"{name1} / {name2}: no contact (swept boxes never meet)")
+        elif report["collides"]:
+            tRange = report["tRange"]
+            when = f" during t = {tRange[0]:.3f} to {tRange[1]:.3f}" if tRange is not None else ""
+            lines.append(f"{name1} / {name2}: collide{when} ({len(report['slabs'])} slabs checked)")
+        else:
+            lines.append(f"{name1} / {name2}: clear ({len(report['slabs'])} slabs checked)")
+    return lines